@@ -0,0 +1,64 @@
+import argparse
+import base64
+import io
+import time
+
+from PIL import Image
+
+from serwer_w import ASCII_CHARS, ascii_cache, image_to_ascii
+
+def legacy_image_to_ascii(image_data, width):
+    # The per-pixel renderer image_to_ascii used before the lookup-table version
+    image_bytes = base64.b64decode(image_data)
+    image = Image.open(io.BytesIO(image_bytes))
+
+    orig_width, orig_height = image.size
+    aspect_ratio = orig_height / orig_width
+    height = int(aspect_ratio * width * 0.5)
+
+    image = image.resize((width, height))
+    image = image.convert('L')
+
+    ascii_str = ""
+    for y in range(height):
+        for x in range(width):
+            pixel_value = image.getpixel((x, y))
+            char_idx = int(pixel_value * (len(ASCII_CHARS)-1) / 255)
+            ascii_str += ASCII_CHARS[char_idx]
+        ascii_str += "\n"
+
+    return ascii_str
+
+def measure(func, image_data, width, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(image_data, width)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def main():
+    parser = argparse.ArgumentParser(description="Porównanie renderera ASCII art przed i po zmianie")
+    parser.add_argument('images', nargs='*', default=['emoji.png', 'test_image.png'])
+    parser.add_argument('--widths', type=int, nargs='+', default=[60, 120, 200])
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+    print(f"{'obraz':<16}{'szer.':>6}{'przed [ms]':>12}{'po [ms]':>10}{'przyspieszenie':>16}{'z cache [ms]':>14}")
+    for path in args.images:
+        with open(path, 'rb') as f:
+            image_data = base64.b64encode(f.read()).decode()
+        for width in args.widths:
+            if legacy_image_to_ascii(image_data, width) != image_to_ascii(image_data, width):
+                raise SystemExit(f"Różny wynik dla {path} przy szerokości {width}")
+            before = measure(legacy_image_to_ascii, image_data, width, args.repeat)
+            # Measure the renderer itself first, then repeated requests served from the cache
+            ascii_cache.clear()
+            ascii_cache.configure(max_entries=0)
+            after = measure(image_to_ascii, image_data, width, args.repeat)
+            ascii_cache.configure(max_entries=256)
+            cached = measure(image_to_ascii, image_data, width, args.repeat)
+            print(f"{path:<16}{width:>6}{before * 1000:>12.2f}{after * 1000:>10.2f}{before / after:>15.1f}x"
+                  f"{cached * 1000:>14.3f}")
+
+if __name__ == "__main__":
+    main()
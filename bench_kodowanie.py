@@ -0,0 +1,56 @@
+import argparse
+import base64
+import time
+
+from protokol import HEADER_SIZE, HEADER, decode_payload, encode_binary_message, encode_message
+
+def sample_messages(image_path):
+    with open(image_path, 'rb') as f:
+        image_data = base64.b64encode(f.read()).decode()
+    return {
+        'text (żądanie)': {'type': 'text', 'message': "Cześć wszystkim, co słychać?", 'client_name': 'ania', 'room': 'kuchnia'},
+        'text (rozgł.)': {'type': 'text', 'room': 'ogólny', 'message': "Wiadomość od ania: Cześć wszystkim, co słychać?"},
+        'direct': {'type': 'direct', 'to': 'bartek', 'message': "psst", 'client_name': 'ania'},
+        'ping': {'type': 'ping'},
+        'image_to_ascii': {'type': 'image_to_ascii', 'image_data': image_data, 'width': 60, 'client_name': 'ania'},
+        'ascii_response': {'type': 'ascii_response', 'data': ("@%#*+=-:. " * 6 + "\n") * 30},
+    }
+
+def measure(func, argument, number, repeat):
+    # Best of repeat runs, per call
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            func(argument)
+        best = min(best, time.perf_counter() - start)
+    return best / number
+
+def decode_frame(frame):
+    _, flags, _ = HEADER.unpack_from(frame)
+    return decode_payload(frame[HEADER_SIZE:], flags)
+
+def main():
+    parser = argparse.ArgumentParser(description="Porównanie kodowania wiadomości JSON i binarnego")
+    parser.add_argument('--image', default='emoji.png', help="Obraz użyty w wiadomości image_to_ascii")
+    parser.add_argument('--number', type=int, default=20000, help="Liczba wywołań w jednym pomiarze")
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+    print(f"{'wiadomość':<18}{'JSON [B]':>10}{'bin. [B]':>10}"
+          f"{'kod. JSON [µs]':>16}{'kod. bin. [µs]':>16}{'dekod. JSON [µs]':>18}{'dekod. bin. [µs]':>18}")
+    for name, message in sample_messages(args.image).items():
+        # Large payloads need fewer calls for a stable measurement
+        number = max(1, args.number // 100) if len(encode_message(message)) > 10000 else args.number
+        json_frame = encode_message(message)
+        binary_frame = encode_binary_message(message)
+        timings = [
+            measure(encode_message, message, number, args.repeat),
+            measure(encode_binary_message, message, number, args.repeat),
+            measure(decode_frame, json_frame, number, args.repeat),
+            measure(decode_frame, binary_frame, number, args.repeat),
+        ]
+        print(f"{name:<18}{len(json_frame):>10}{len(binary_frame):>10}"
+              f"{timings[0] * 1e6:>16.2f}{timings[1] * 1e6:>16.2f}{timings[2] * 1e6:>18.2f}{timings[3] * 1e6:>18.2f}")
+
+if __name__ == "__main__":
+    main()
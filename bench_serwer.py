@@ -0,0 +1,388 @@
+import argparse
+import base64
+import datetime
+import json
+import math
+import os
+import random
+import socket
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from protokol import CODECS, MessageReader, ProtocolError, encode_binary_message, encode_message
+from przesylanie import upload_file
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+BENCH_PREFIX = "bench"
+REQUEST_TYPES = ('text', 'image', 'docx', 'ping')
+# The reply each request waits for; a busy reply names the request it refuses instead
+REPLY_TYPES = {'image': 'ascii_response', 'docx': 'docx_response', 'ping': 'pong'}
+BUSY_REPLIES = {'image_to_ascii': 'ascii_response', 'upload_start': 'docx_response', 'ping': 'pong'}
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    # Nearest-rank percentile
+    index = max(0, math.ceil(fraction * len(sorted_values)) - 1)
+    return sorted_values[index]
+
+def summarize(samples):
+    values = sorted(samples)
+    return {
+        'count': len(values),
+        'p50_ms': _ms(percentile(values, 0.50)),
+        'p95_ms': _ms(percentile(values, 0.95)),
+        'p99_ms': _ms(percentile(values, 0.99)),
+        'max_ms': _ms(values[-1] if values else None),
+    }
+
+def _ms(seconds):
+    return round(seconds * 1000, 3) if seconds is not None else None
+
+def read_rss(pid):
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        import psutil
+        return psutil.Process(pid).memory_info().rss
+    except Exception:
+        return None
+
+def process_tree(pid):
+    # The server's conversion pool, its forkserver and --instances run as child processes
+    children = {}
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                # The name in parentheses may contain spaces; the parent PID follows the state
+                parent = int(f.read().rsplit(')', 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(parent, []).append(int(entry))
+    pids = [pid]
+    for current in pids:
+        pids.extend(children.get(current, ()))
+    return pids
+
+def read_tree_rss(pid):
+    if os.path.isdir('/proc'):
+        samples = [read_rss(p) for p in process_tree(pid)]
+        return sum(rss for rss in samples if rss is not None) if samples[0] is not None else None
+    try:
+        import psutil
+        process = psutil.Process(pid)
+        return sum(p.memory_info().rss for p in [process] + process.children(recursive=True))
+    except Exception:
+        return None
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(','):
+        name, _, weight = part.partition('=')
+        if name not in REQUEST_TYPES:
+            raise argparse.ArgumentTypeError(f"Nieznany typ żądania: {name}")
+        mix[name] = float(weight or 1)
+    return mix
+
+class Stats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = {name: [] for name in REQUEST_TYPES}
+        self.broadcast_lag = []
+        # Distinct text messages that reached at least one other client
+        self.delivered_texts = set()
+        self.errors = 0
+        self.busy = 0
+        self.late_replies = 0
+        self.sent = {name: 0 for name in REQUEST_TYPES}
+
+    def record(self, name, seconds):
+        with self.lock:
+            self.latencies[name].append(seconds)
+
+class SyntheticClient:
+    def __init__(self, index, args, stats, fixtures, deadline):
+        self.name = f"{BENCH_PREFIX}{index}"
+        self.args = args
+        self.stats = stats
+        self.fixtures = fixtures
+        self.deadline = deadline
+        self.random = random.Random(index)
+        if args.unix:
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.sock.connect(args.unix)
+        else:
+            self.sock = socket.create_connection((args.host, args.port))
+            self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        # Requests go out in the encoding the server is asked for below
+        self.encode = encode_binary_message if args.binary else encode_message
+        if args.binary:
+            self.sock.sendall(encode_message({'type': 'encoding', 'encoding': 'binary'}))
+        if args.compression:
+            # The reply is ignored; compressed frames are unpacked by MessageReader
+            self.sock.sendall(encode_message({'type': 'compression', 'codec': args.compression}))
+        self.response = None
+        self.response_ready = threading.Event()
+        # The server answers one connection's requests in order, so a reply is matched to the
+        # request waiting for its type, after the replies still owed to timed-out requests
+        self.reply_lock = threading.Lock()
+        self.expected = None
+        self.owed = {}
+        self.reader_thread = threading.Thread(target=self.read_loop, daemon=True)
+        self.reader_thread.start()
+
+    def read_loop(self):
+        reader = MessageReader(self.sock)
+        try:
+            for message in reader:
+                received = time.perf_counter()
+                if message.get('type') == 'busy':
+                    # Refused by the server's admission control; counted apart from answers
+                    with self.stats.lock:
+                        self.stats.busy += 1
+                    self.reply(BUSY_REPLIES.get(message.get('request')), message)
+                elif message.get('type') in REPLY_TYPES.values():
+                    self.reply(message['type'], message)
+                elif message.get('type') == 'text':
+                    self.record_broadcast(message.get('message', ''), received)
+        except (OSError, ProtocolError):
+            pass
+
+    def reply(self, reply_type, message):
+        with self.reply_lock:
+            if self.owed.get(reply_type):
+                self.owed[reply_type] -= 1
+                with self.stats.lock:
+                    self.stats.late_replies += 1
+                return
+            if reply_type is None or reply_type != self.expected:
+                return
+            self.expected = None
+            self.response = message
+        self.response_ready.set()
+
+    def record_broadcast(self, text, received):
+        # Text broadcasts carry "bench:<sent perf_counter>" so every recipient can measure lag
+        marker = text.rfind(f"{BENCH_PREFIX}:")
+        if marker < 0:
+            return
+        try:
+            sent = float(text[marker + len(BENCH_PREFIX) + 1:].split()[0])
+        except (ValueError, IndexError):
+            return
+        with self.stats.lock:
+            self.stats.broadcast_lag.append(received - sent)
+            self.stats.delivered_texts.add(text)
+
+    def request(self, name, send):
+        reply_type = REPLY_TYPES[name]
+        with self.reply_lock:
+            self.response_ready.clear()
+            self.expected = reply_type
+        start = time.perf_counter()
+        send()
+        if not self.response_ready.wait(self.args.timeout):
+            with self.reply_lock:
+                if self.expected is not None:
+                    # The reply may still come; it must not be taken for the next request's
+                    self.expected = None
+                    self.owed[reply_type] = self.owed.get(reply_type, 0) + 1
+            with self.stats.lock:
+                self.stats.errors += 1
+            return
+        if self.response.get('type') == 'busy':
+            # Back off as asked instead of hammering the limit
+            time.sleep(min(self.response.get('retry_after', 1.0), max(0.0, self.deadline - time.perf_counter())))
+            return
+        self.stats.record(name, time.perf_counter() - start)
+
+    def run(self):
+        names = list(self.args.mix)
+        weights = [self.args.mix[name] for name in names]
+        while time.perf_counter() < self.deadline:
+            name = self.random.choices(names, weights)[0]
+            with self.stats.lock:
+                self.stats.sent[name] += 1
+            try:
+                if name == 'text':
+                    # No reply to the sender; its latency is the broadcast lag seen by the others
+                    self.sock.sendall(self.encode({
+                        'type': 'text',
+                        'message': f"{BENCH_PREFIX}:{time.perf_counter()!r}",
+                        'client_name': self.name
+                    }))
+                elif name == 'image':
+                    self.request(name, lambda: self.sock.sendall(self.encode({
+                        'type': 'image_to_ascii',
+                        'image_data': self.fixtures['image'],
+                        'width': self.args.width,
+                        'prescaled': self.args.prescale,
+                        'client_name': self.name
+                    })))
+                elif name == 'ping':
+                    # Round trip with no work on the server: the transport's own latency
+                    self.request(name, lambda: self.sock.sendall(self.encode({'type': 'ping'})))
+                else:
+                    self.request(name, lambda: upload_file(self.sock.sendall, self.fixtures['docx'], self.name))
+            except OSError:
+                with self.stats.lock:
+                    self.stats.errors += 1
+                return
+            if self.args.think > 0:
+                time.sleep(self.random.expovariate(1 / self.args.think))
+
+    def close(self):
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+
+def wait_for_port(host, port, timeout):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            socket.create_connection((host, port), timeout=0.5).close()
+            return True
+        except OSError:
+            time.sleep(0.1)
+    return False
+
+def start_server(args, workdir):
+    # Run in a scratch directory so benchmark uploads don't land in the repo's odebrane_pliki
+    command = [sys.executable, os.path.join(REPO_DIR, 'serwer_w.py'),
+               '--host', args.host, '--port', str(args.port)] + args.server_args
+    if args.unix:
+        command += ['--unix-socket', args.unix]
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [REPO_DIR, os.environ.get('PYTHONPATH')])))
+    server = subprocess.Popen(command, cwd=workdir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    if not wait_for_port(args.host, args.port, 15):
+        server.kill()
+        raise SystemExit("Serwer nie wystartował")
+    return server
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Generator obciążenia i pomiar wydajności serwera")
+    parser.add_argument('--clients', type=int, default=20)
+    parser.add_argument('--duration', type=float, default=10.0, help="Czas trwania pomiaru (s)")
+    parser.add_argument('--mix', type=parse_mix, default=parse_mix('text=8,image=1,docx=1'),
+                        help="Proporcje typów żądań, np. text=8,image=1,docx=1 lub ping=1")
+    parser.add_argument('--think', type=float, default=0.0,
+                        help="Średni odstęp (s) między żądaniami jednego klienta")
+    parser.add_argument('--width', type=int, default=60, help="Szerokość ASCII art")
+    parser.add_argument('--image', default=os.path.join(REPO_DIR, 'emoji.png'),
+                        help="Obraz do konwersji, np. emoji.png lub test_image.png")
+    parser.add_argument('--prescale', action='store_true',
+                        help="Wysyłaj obraz pomniejszony po stronie klienta (obrazy.prescale_image)")
+    parser.add_argument('--binary', action='store_true',
+                        help="Używaj binarnego kodowania wiadomości zamiast JSON")
+    parser.add_argument('--compression', choices=tuple(CODECS), default=None,
+                        help="Poproś serwer o kompresję odpowiedzi tym kodekiem")
+    parser.add_argument('--docx', default=os.path.join(REPO_DIR, 'Dokument.docx'))
+    parser.add_argument('--timeout', type=float, default=30.0, help="Limit oczekiwania na odpowiedź (s)")
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=8899)
+    parser.add_argument('--unix', default=None, metavar='ŚCIEŻKA',
+                        help="Łącz klientów przez gniazdo Unix serwera zamiast TCP")
+    parser.add_argument('--no-server', action='store_true',
+                        help="Nie uruchamiaj serwera, użyj już działającego pod --host/--port")
+    parser.add_argument('--server-pid', type=int, default=None,
+                        help="PID działającego serwera do pomiaru RSS (z --no-server)")
+    parser.add_argument('--output', default=None,
+                        help="Dopisz wynik jako linię JSON do tego pliku (śledzenie regresji)")
+    parser.add_argument('server_args', nargs=argparse.REMAINDER,
+                        help="Dodatkowe argumenty serwera po '--', np. -- --async")
+    args = parser.parse_args(argv)
+    if args.server_args[:1] == ['--']:
+        args.server_args = args.server_args[1:]
+    return args
+
+def main(argv=None):
+    args = parse_args(argv)
+    with open(args.image, 'rb') as f:
+        image_bytes = f.read()
+    if args.prescale:
+        from obrazy import prescale_image
+        image_bytes = prescale_image(image_bytes, args.width)
+    fixtures = {'image': base64.b64encode(image_bytes).decode(), 'docx': args.docx}
+
+    workdir = None if args.no_server else tempfile.mkdtemp(prefix='bench_serwer_')
+    server = None if args.no_server else start_server(args, workdir)
+    server_pid = server.pid if server else args.server_pid
+    stats = Stats()
+    rss_samples = []
+    try:
+        deadline = time.perf_counter() + args.duration
+        clients = [SyntheticClient(i, args, stats, fixtures, deadline) for i in range(args.clients)]
+        threads = [threading.Thread(target=client.run, daemon=True) for client in clients]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        while any(thread.is_alive() for thread in threads):
+            if server_pid:
+                rss = read_tree_rss(server_pid)
+                if rss is not None:
+                    rss_samples.append(rss)
+            time.sleep(0.2)
+        elapsed = time.perf_counter() - started
+        # Give in-flight broadcasts a moment to arrive before measuring lag
+        time.sleep(0.5)
+        for client in clients:
+            client.close()
+    finally:
+        if server:
+            server.terminate()
+            try:
+                server.wait(10)
+            except subprocess.TimeoutExpired:
+                server.kill()
+        if workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    completed = len(stats.delivered_texts) + sum(len(samples) for samples in stats.latencies.values())
+    result = {
+        'timestamp': datetime.datetime.now().isoformat(timespec='seconds'),
+        'config': {
+            'clients': args.clients,
+            'duration': args.duration,
+            'mix': args.mix,
+            'think': args.think,
+            'width': args.width,
+            'image': args.image,
+            'compression': args.compression,
+            'binary': args.binary,
+            'unix': args.unix,
+            'server_args': args.server_args,
+        },
+        'elapsed_s': round(elapsed, 3),
+        'completed': completed,
+        'errors': stats.errors,
+        'busy': stats.busy,
+        'late_replies': stats.late_replies,
+        'throughput_rps': round(completed / elapsed, 2) if elapsed else None,
+        'sent': stats.sent,
+        'latency': {name: summarize(samples) for name, samples in stats.latencies.items() if samples},
+        'broadcast_lag': summarize(stats.broadcast_lag),
+        'server_rss_bytes': {
+            'max': max(rss_samples) if rss_samples else None,
+            'last': rss_samples[-1] if rss_samples else None,
+        },
+    }
+
+    print(json.dumps(result, indent=2, ensure_ascii=False))
+    if args.output:
+        with open(args.output, 'a') as f:
+            f.write(json.dumps(result, ensure_ascii=False) + "\n")
+
+if __name__ == "__main__":
+    main()
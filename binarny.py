@@ -0,0 +1,118 @@
+import base64
+import struct
+
+# Compact alternative to JSON for the most frequent messages. A payload is the type code,
+# a bitmask of the fields present and then each present field in schema order:
+#   s - UTF-8 text up to 64 KB, S - longer UTF-8 text, i - integer, ? - flag,
+#   b - raw bytes (base64 text in JSON, so it is decoded on the way in)
+# Messages of other types, with other keys or values that don't fit go as JSON.
+SCHEMAS = (
+    ('text', (('message', 'S'), ('client_name', 's'), ('room', 's'))),
+    ('ping', ()),
+    ('pong', ()),
+    ('direct', (('to', 's'), ('message', 'S'), ('client_name', 's'), ('from', 's'), ('error', 'S'))),
+    ('join', (('room', 's'), ('client_name', 's'))),
+    ('leave', (('room', 's'), ('client_name', 's'))),
+    ('stats', (('client_name', 's'),)),
+    ('image_to_ascii', (('image_data', 'b'), ('width', 'i'), ('prescaled', '?'), ('client_name', 's'))),
+    ('ascii_response', (('data', 'S'),)),
+)
+
+HEADER = struct.Struct('!BB')
+SHORT = struct.Struct('!H')
+LONG = struct.Struct('!I')
+INTEGER = struct.Struct('!q')
+FLAG = struct.Struct('!?')
+
+# type -> (code, fields, allowed keys) and code -> (type, fields), where each field
+# is (mask bit, name, kind)
+_by_type = {}
+_by_code = {}
+for _code, (_type, _fields) in enumerate(SCHEMAS, 1):
+    _fields = tuple((1 << _bit, _name, _kind) for _bit, (_name, _kind) in enumerate(_fields))
+    _by_type[_type] = (_code, _fields, frozenset(name for _, name, _ in _fields) | {'type'})
+    _by_code[_code] = (_type, _fields)
+
+def encode(message):
+    # Returns None when the message has to go as JSON
+    schema = _by_type.get(message.get('type'))
+    if schema is None:
+        return None
+    code, fields, allowed = schema
+    if not allowed.issuperset(message):
+        return None
+    mask = 0
+    parts = [b'']
+    for bit, name, kind in fields:
+        if name not in message:
+            continue
+        value = message[name]
+        mask |= bit
+        if kind == 's' or kind == 'S':
+            if value.__class__ is not str:
+                return None
+            data = value.encode()
+            if kind == 's':
+                if len(data) > 0xFFFF:
+                    return None
+                parts.append(SHORT.pack(len(data)))
+            else:
+                parts.append(LONG.pack(len(data)))
+            parts.append(data)
+        elif kind == 'i':
+            if value.__class__ is not int or not -2 ** 63 <= value < 2 ** 63:
+                return None
+            parts.append(INTEGER.pack(value))
+        elif kind == '?':
+            if value.__class__ is not bool:
+                return None
+            parts.append(FLAG.pack(value))
+        else:
+            if isinstance(value, str):
+                try:
+                    value = base64.b64decode(value, validate=True)
+                except ValueError:
+                    return None
+            elif not isinstance(value, (bytes, bytearray)):
+                return None
+            parts.append(LONG.pack(len(value)))
+            parts.append(value)
+    parts[0] = HEADER.pack(code, mask)
+    return b''.join(parts)
+
+def decode(payload):
+    # Raises ValueError for a payload that doesn't match its schema
+    try:
+        code, mask = HEADER.unpack_from(payload)
+        message_type, fields = _by_code[code]
+        if mask >> len(fields):
+            raise ValueError("nieznane pola w masce")
+        message = {'type': message_type}
+        offset = 2
+        for bit, name, kind in fields:
+            if not mask & bit:
+                continue
+            if kind == 's':
+                length = (payload[offset] << 8) | payload[offset + 1]
+                offset += 2
+            elif kind == 'S' or kind == 'b':
+                length, = LONG.unpack_from(payload, offset)
+                offset += 4
+            elif kind == 'i':
+                message[name], = INTEGER.unpack_from(payload, offset)
+                offset += 8
+                continue
+            else:
+                message[name] = payload[offset] != 0
+                offset += 1
+                continue
+            end = offset + length
+            if end > len(payload):
+                raise ValueError("pole wykracza poza ramkę")
+            message[name] = bytes(payload[offset:end]) if kind == 'b' else str(payload[offset:end], 'utf-8')
+            offset = end
+    except (IndexError, KeyError, struct.error, UnicodeDecodeError) as e:
+        raise ValueError(f"niepoprawna ramka binarna: {e}")
+    if offset != len(payload):
+        raise ValueError("nadmiarowe bajty na końcu ramki")
+    return message
@@ -0,0 +1,136 @@
+import io
+import posixpath
+import zipfile
+import xml.etree.ElementTree as ET
+
+W = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+DC_TITLE = '{http://purl.org/dc/elements/1.1/}title'
+RELATIONSHIP = '{http://schemas.openxmlformats.org/package/2006/relationships}Relationship'
+OFFICE_DOCUMENT = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument'
+CORE_PROPERTIES = 'http://schemas.openxmlformats.org/package/2006/relationships/metadata/core-properties'
+
+BODY = W + 'body'
+PARAGRAPH = W + 'p'
+TABLE = W + 'tbl'
+ROW = W + 'tr'
+CELL = W + 'tc'
+
+def _part_targets(archive):
+    targets = {'document': 'word/document.xml', 'core': 'docProps/core.xml'}
+    try:
+        rels = ET.fromstring(archive.read('_rels/.rels'))
+    except KeyError:
+        return targets
+    for rel in rels.iter(RELATIONSHIP):
+        target = posixpath.normpath(rel.get('Target', '').lstrip('/'))
+        if rel.get('Type') == OFFICE_DOCUMENT:
+            targets['document'] = target
+        elif rel.get('Type') == CORE_PROPERTIES:
+            targets['core'] = target
+    return targets
+
+def _title(archive, core_part):
+    try:
+        with archive.open(core_part) as f:
+            for _, elem in ET.iterparse(f):
+                if elem.tag == DC_TITLE:
+                    return elem.text or ''
+    except KeyError:
+        pass
+    return ''
+
+def _run_text(run):
+    # Same characters python-docx's Run.text produces
+    parts = []
+    for child in run:
+        tag = child.tag
+        if tag == W + 't':
+            parts.append(child.text or '')
+        elif tag in (W + 'tab', W + 'ptab'):
+            parts.append('\t')
+        elif tag == W + 'br':
+            if child.get(W + 'type', 'textWrapping') == 'textWrapping':
+                parts.append('\n')
+        elif tag == W + 'cr':
+            parts.append('\n')
+        elif tag == W + 'noBreakHyphen':
+            parts.append('-')
+    return ''.join(parts)
+
+def paragraph_text(paragraph):
+    parts = []
+    for child in paragraph:
+        if child.tag == W + 'r':
+            parts.append(_run_text(child))
+        elif child.tag == W + 'hyperlink':
+            parts.extend(_run_text(run) for run in child.iter(W + 'r'))
+    return ''.join(parts)
+
+def _cell_text(cell):
+    return '\n'.join(paragraph_text(p) for p in cell.findall(PARAGRAPH))
+
+def _row_cells(row, above):
+    # One entry per grid column like python-docx: horizontally merged cells repeat,
+    # vertically merged continuations repeat the text of the cell above
+    cells = []
+    for cell in row.findall(CELL):
+        properties = cell.find(W + 'tcPr')
+        span = 1
+        text = None
+        if properties is not None:
+            grid_span = properties.find(W + 'gridSpan')
+            if grid_span is not None:
+                span = int(grid_span.get(W + 'val', 1))
+            v_merge = properties.find(W + 'vMerge')
+            if v_merge is not None and v_merge.get(W + 'val', 'continue') == 'continue':
+                column = len(cells)
+                text = above[column] if column < len(above) else ''
+        if text is None:
+            text = _cell_text(cell)
+        cells.extend([text] * span)
+    return cells
+
+def iter_docx_text(source):
+    # source is a path or the raw bytes of a .docx; yields the same lines
+    # extract_docx_text builds, in document order
+    archive = zipfile.ZipFile(source if isinstance(source, str) else io.BytesIO(source))
+    with archive:
+        targets = _part_targets(archive)
+        title = _title(archive, targets['core'])
+        if title:
+            yield f"Tytuł: {title}"
+            yield "=" * 40
+
+        with archive.open(targets['document']) as f:
+            stack = []
+            above = []
+            for event, elem in ET.iterparse(f, events=('start', 'end')):
+                if event == 'start':
+                    stack.append(elem)
+                    continue
+                stack.pop()
+                parent = stack[-1] if stack else None
+                top_level = parent is not None and parent.tag == BODY
+                table_row = elem.tag == ROW and len(stack) >= 2 and parent.tag == TABLE and stack[-2].tag == BODY
+                if not (top_level or table_row):
+                    continue
+
+                # Only top-level paragraphs and rows of top-level tables are kept in
+                # memory, and each is dropped as soon as its text has been yielded
+                if elem.tag == PARAGRAPH:
+                    text = paragraph_text(elem)
+                    if text:
+                        yield text
+                elif elem.tag == ROW:
+                    cells = _row_cells(elem, above)
+                    above = cells
+                    if any(cells):
+                        yield " | ".join(cells)
+                    parent.remove(elem)
+                    continue
+                elif elem.tag == TABLE:
+                    above = []
+                parent.remove(elem)
+
+def extract_docx_text_fast(source):
+    return "\n".join(iter_docx_text(source))
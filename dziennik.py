@@ -0,0 +1,84 @@
+import copy
+import logging
+import logging.handlers
+import queue
+import sys
+import threading
+
+LEVELS = ('debug', 'info', 'warning', 'error')
+QUEUE_SIZE = 10000
+# Configured by configure(); longer payloads (ASCII art, document text) are cut in the log
+PAYLOAD_LIMIT = 500
+
+log = logging.getLogger('serwer')
+
+class FieldsFormatter(logging.Formatter):
+    # Structured fields passed as extra={'fields': {...}} follow the message as key=value
+    def format(self, record):
+        text = super().format(record)
+        fields = getattr(record, 'fields', None)
+        if fields:
+            text += ' ' + ' '.join(f"{key}={value}" for key, value in fields.items())
+        return text
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    # Never blocks the logging thread; with the queue full the record is dropped and counted
+    def __init__(self, records):
+        super().__init__(records)
+        self.dropped = 0
+        self._dropped_lock = threading.Lock()
+
+    def prepare(self, record):
+        # The inherited prepare formats the whole record here. Only the arguments are merged,
+        # since they may change after the call; the listener thread does the formatting
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            with self._dropped_lock:
+                self.dropped += 1
+
+_handler = None
+_listener = None
+
+def configure(level='info', log_file=None, payload_limit=PAYLOAD_LIMIT, queue_size=QUEUE_SIZE):
+    # Records are only queued on the calling thread; a listener thread formats and writes them
+    global _handler, _listener, PAYLOAD_LIMIT
+    shutdown()
+    PAYLOAD_LIMIT = payload_limit
+    target = logging.FileHandler(log_file, encoding='utf-8') if log_file else logging.StreamHandler(sys.stdout)
+    target.setFormatter(FieldsFormatter('%(asctime)s %(levelname)s %(message)s'))
+    _handler = DroppingQueueHandler(queue.Queue(queue_size))
+    log.handlers[:] = [_handler]
+    log.setLevel(level.upper())
+    log.propagate = False
+    _listener = logging.handlers.QueueListener(_handler.queue, target)
+    _listener.start()
+
+def shutdown():
+    # Writes out whatever is still queued
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+def fields(**values):
+    return {'fields': values}
+
+def truncate(text, limit=None):
+    limit = PAYLOAD_LIMIT if limit is None else limit
+    if len(text) <= limit:
+        return text
+    return f"{text[:limit]}... (pominięto {len(text) - limit} znaków)"
+
+def stats():
+    return {
+        'level': logging.getLevelName(log.level).lower(),
+        'queued': _handler.queue.qsize() if _handler else 0,
+        'dropped': _handler.dropped if _handler else 0,
+    }
@@ -0,0 +1,249 @@
+import mmap
+import os
+import struct
+import threading
+import time
+
+# One index entry per message: time, offset in the segment's .log and length
+INDEX_ENTRY = struct.Struct('!dQI')
+
+class Segment:
+    def __init__(self, directory, base):
+        # base is the sequence number of the segment's first message
+        self.base = base
+        self.log_path = os.path.join(directory, f"{base:020d}.log")
+        self.index_path = os.path.join(directory, f"{base:020d}.idx")
+
+    def count(self):
+        try:
+            return os.path.getsize(self.index_path) // INDEX_ENTRY.size
+        except OSError:
+            return 0
+
+    def size(self):
+        try:
+            return os.path.getsize(self.log_path) + os.path.getsize(self.index_path)
+        except OSError:
+            return 0
+
+class IndexView:
+    # Read-only view of the entries written to a segment's index so far
+    def __init__(self, segment):
+        self.count = segment.count()
+        self._file = open(segment.index_path, 'rb')
+        self._map = mmap.mmap(self._file.fileno(), self.count * INDEX_ENTRY.size, access=mmap.ACCESS_READ) if self.count else None
+
+    def entry(self, position):
+        return INDEX_ENTRY.unpack_from(self._map, position * INDEX_ENTRY.size)
+
+    def time(self, position):
+        return self.entry(position)[0]
+
+    def find_time(self, timestamp):
+        # First entry at or after timestamp; entries are appended in time order
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if self.time(middle) < timestamp:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+        self._file.close()
+
+class MessageLog:
+    def __init__(self, directory, segment_bytes=16 * 1024 * 1024, max_bytes=256 * 1024 * 1024, retention_seconds=None):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.max_bytes = max_bytes
+        self.retention_seconds = retention_seconds
+        self.appended = 0
+        self.deleted_segments = 0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._segments = [Segment(directory, int(name[:-4])) for name in sorted(os.listdir(directory))
+                          if name.endswith('.log') and name[:-4].isdigit()]
+        if not self._segments:
+            self._segments.append(Segment(directory, 0))
+        self._open_active()
+        self._apply_retention()
+
+    def _open_active(self):
+        segment = self._segments[-1]
+        # Drop whatever a crash left behind after the last complete index entry
+        count = segment.count()
+        end = 0
+        if count:
+            with open(segment.index_path, 'rb') as f:
+                f.seek((count - 1) * INDEX_ENTRY.size)
+                _, offset, length = INDEX_ENTRY.unpack(f.read(INDEX_ENTRY.size))
+                end = offset + length
+        self._log = open(segment.log_path, 'ab')
+        self._log.truncate(end)
+        self._index = open(segment.index_path, 'ab')
+        self._index.truncate(count * INDEX_ENTRY.size)
+        self._size = end
+        self._next = segment.base + count
+        self._active_since = self._first_time(segment) if count else None
+
+    def append(self, frame, timestamp=None):
+        # frame is an already encoded message; history replays the same bytes
+        timestamp = timestamp or time.time()
+        with self._lock:
+            if self._size >= self.segment_bytes or self._active_expired(timestamp):
+                self._roll()
+            self._log.write(frame)
+            self._log.flush()
+            self._index.write(INDEX_ENTRY.pack(timestamp, self._size, len(frame)))
+            self._index.flush()
+            if self._active_since is None:
+                self._active_since = timestamp
+            self._size += len(frame)
+            self._next += 1
+            self.appended += 1
+
+    def expire(self):
+        # Retention otherwise only runs when a segment fills up, which a quiet
+        # room may never do; the server calls this periodically
+        with self._lock:
+            if self._active_expired(time.time()):
+                self._roll()
+            else:
+                self._apply_retention()
+
+    def _active_expired(self, now):
+        # The active segment is rolled once its oldest message is past retention,
+        # so that the retention below can delete it
+        return (self.retention_seconds is not None and self._active_since is not None
+                and now - self._active_since > self.retention_seconds)
+
+    def _roll(self):
+        self._log.close()
+        self._index.close()
+        self._segments.append(Segment(self.directory, self._next))
+        self._open_active()
+        self._apply_retention()
+
+    def _apply_retention(self):
+        # The active segment is never deleted
+        now = time.time()
+        total = sum(segment.size() for segment in self._segments)
+        while len(self._segments) > 1:
+            oldest = self._segments[0]
+            expired = False
+            if self.retention_seconds is not None:
+                newest_time = self._last_time(oldest)
+                expired = newest_time is None or now - newest_time > self.retention_seconds
+            if not expired and (self.max_bytes is None or total <= self.max_bytes):
+                break
+            total -= oldest.size()
+            for path in (oldest.log_path, oldest.index_path):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            self._segments.pop(0)
+            self.deleted_segments += 1
+
+    def _last_time(self, segment):
+        count = segment.count()
+        if not count:
+            return None
+        with open(segment.index_path, 'rb') as f:
+            f.seek((count - 1) * INDEX_ENTRY.size)
+            return INDEX_ENTRY.unpack(f.read(INDEX_ENTRY.size))[0]
+
+    def last(self, count):
+        # The newest count messages, oldest first
+        with self._lock:
+            segments = list(self._segments)
+        start = []
+        remaining = count
+        for segment in reversed(segments):
+            if remaining <= 0:
+                break
+            available = segment.count()
+            take = min(available, remaining)
+            start.insert(0, (segment, available - take, available))
+            remaining -= take
+        for segment, first, end in start:
+            yield from self._read(segment, first, end)
+
+    def between(self, since=None, until=None, limit=None):
+        # Messages with since <= time < until, oldest first, at most limit of them
+        with self._lock:
+            segments = list(self._segments)
+        sent = 0
+        for position, segment in enumerate(segments):
+            # A later segment starting before since means this one ends before it too
+            if since is not None and position + 1 < len(segments):
+                next_first = self._first_time(segments[position + 1])
+                if next_first is not None and next_first < since:
+                    continue
+            try:
+                view = IndexView(segment)
+            except OSError:
+                continue
+            try:
+                first = view.find_time(since) if since is not None else 0
+                end = view.find_time(until) if until is not None else view.count
+                if limit is not None:
+                    end = min(end, first + limit - sent)
+            finally:
+                view.close()
+            for frame in self._read(segment, first, end):
+                yield frame
+                sent += 1
+            if (limit is not None and sent >= limit) or (until is not None and end < segment.count()):
+                return
+
+    def _first_time(self, segment):
+        try:
+            with open(segment.index_path, 'rb') as f:
+                data = f.read(INDEX_ENTRY.size)
+        except OSError:
+            return None
+        return INDEX_ENTRY.unpack(data)[0] if len(data) == INDEX_ENTRY.size else None
+
+    def _read(self, segment, first, end):
+        # Messages are contiguous in the log, so one seek and sequential reads
+        if first >= end:
+            return
+        try:
+            view = IndexView(segment)
+            log = open(segment.log_path, 'rb')
+        except OSError:
+            # Removed by retention in the meantime
+            return
+        with log:
+            try:
+                end = min(end, view.count)
+                if first >= end:
+                    return
+                log.seek(view.entry(first)[1])
+                for position in range(first, end):
+                    yield log.read(view.entry(position)[2])
+            finally:
+                view.close()
+
+    def close(self):
+        with self._lock:
+            self._log.close()
+            self._index.close()
+
+    def stats(self):
+        with self._lock:
+            segments = list(self._segments)
+            first = segments[0].base
+            last = self._next
+        return {
+            'segments': len(segments),
+            'messages': last - first,
+            'bytes': sum(segment.size() for segment in segments),
+            'appended': self.appended,
+            'deleted_segments': self.deleted_segments,
+        }
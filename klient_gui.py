@@ -1,122 +1,182 @@
-import socket
 import threading
-import json
 import os
 import base64
 from PIL import Image
 import io
 from PySide6.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout, QHBoxLayout, 
-                              QPushButton, QTextEdit, QLineEdit, QLabel, QFileDialog,
+                              QPushButton, QListView, QLineEdit, QLabel, QFileDialog,
                               QComboBox, QInputDialog, QSpinBox, QMessageBox, QSplitter,
-                              QScrollBar)
-from PySide6.QtCore import Qt, Signal, Slot, QThread
-from PySide6.QtGui import QFont, QTextCursor
+                              QScrollBar, QAbstractItemView, QProgressBar)
+from PySide6.QtCore import Qt, Signal, Slot, QThread, QTimer, QAbstractListModel, QModelIndex
+from PySide6.QtGui import QFont, QColor
+from polaczenie import Connection
+from obrazy import prescale_image
+from polecenia import HELP, ChatCommands
+
+HISTORY_ON_CONNECT = 20
 
 class ClientThread(QThread):
     message_received = Signal(dict)
     connection_error = Signal(str)
+    status_changed = Signal(str)
+    send_progress = Signal(object)
+    send_finished = Signal(object)
+    # Emitted on a reconnect just before the history is requested again
+    history_reloading = Signal()
     
-    def __init__(self, host, port, client_name):
+    def __init__(self, host, port, client_name, unix_path=None):
         super().__init__()
         self.host = host
         self.port = port
+        self.unix_path = unix_path
         self.client_name = client_name
-        self.client = None
-        self.running = True
+        # Made here rather than in run() so stop() can end the connect and retry loops
+        # even before the thread has got that far
+        self.connection = Connection(host, port, self.handle_response,
+                                     on_status=self.status_changed.emit,
+                                     on_progress=self.send_progress.emit, on_finished=self.send_finished.emit,
+                                     unix_path=unix_path)
+        # Filled from the server's welcome message; older servers don't send one
+        self.capabilities = set()
+        self.commands = ChatCommands(client_name)
+        self.welcomed = False
         
     def run(self):
-        try:
-            self.client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            self.client.connect((self.host, self.port))
-            
-            while self.running:
-                try:
-                    response = self.client.recv(4096)
-                    if not response:
-                        break
-                        
-                    try:
-                        json_response = json.loads(response.decode())
-                        self.message_received.emit(json_response)
-                    except json.JSONDecodeError:
-                        self.message_received.emit({
-                            'type': 'text',
-                            'message': response.decode()
-                        })
-                except Exception as e:
-                    self.connection_error.emit(f"Błąd odbioru: {str(e)}")
-                    break
-        except Exception as e:
-            self.connection_error.emit(f"Błąd połączenia: {str(e)}")
+        # Reconnects by itself until stop(); callbacks reach the GUI as queued signals
+        self.connection.run()
+    
+    def handle_response(self, json_response):
+        if json_response.get('type') == 'welcome':
+            self.capabilities = set(json_response.get('capabilities', []))
+            # After a reconnect the server has forgotten the room this client was in
+            room = self.commands.room if self.commands.room is not None else json_response.get('room', 'ogólny')
+            self.send_message('join', {'room': room})
+            # Catch up on what was said before this client joined. After a reconnect the
+            # same messages come again, so the view starts over instead of showing them twice
+            if 'history' in self.capabilities:
+                if self.welcomed:
+                    self.history_reloading.emit()
+                self.request_history(HISTORY_ON_CONNECT)
+            self.welcomed = True
+            return
+        self.message_received.emit(json_response)
         
-    def send_message(self, message_type, data):
-        if not self.client:
-            return False
-            
-        try:
-            request = {
-                'type': message_type,
-                'client_name': self.client_name,
-                **data
-            }
-            self.client.send(json.dumps(request).encode())
-            return True
-        except Exception as e:
-            self.connection_error.emit(f"Błąd wysyłania: {str(e)}")
-            return False
+    def send_message(self, message_type, data, description=None):
+        request = {
+            'type': message_type,
+            'client_name': self.client_name,
+            **data
+        }
+        return self.connection.send_message(request, description)
             
     def send_text_message(self, message):
-        return self.send_message('text', {'message': message})
+        # Plain text goes to the current room; /join, /leave and /msg become their requests
+        try:
+            request = self.commands.parse(message)
+        except ValueError as e:
+            self.connection_error.emit(str(e))
+            return None
+        return self.send_message(request.pop('type'), request)
     
     def send_image_request(self, image_path, width):
         if not os.path.exists(image_path):
             self.connection_error.emit(f"Błąd: Plik {image_path} nie istnieje.")
-            return False
+            return None
             
         try:
             with open(image_path, 'rb') as img_file:
-                img_data = base64.b64encode(img_file.read()).decode()
+                image_bytes = img_file.read()
                 
-            return self.send_message('image_to_ascii', {
-                'image_data': img_data,
-                'width': width
-            })
+            request = {'width': width}
+            if 'image_prescaled' in self.capabilities:
+                # Send only the pixels the server needs for this width
+                image_bytes = prescale_image(image_bytes, width)
+                request['prescaled'] = True
+            request['image_data'] = base64.b64encode(image_bytes).decode()
+            return self.send_message('image_to_ascii', request, os.path.basename(image_path))
         except Exception as e:
             self.connection_error.emit(f"Błąd wysyłania obrazu: {str(e)}")
-            return False
+            return None
     
     def send_docx_file(self, file_path):
         if not os.path.exists(file_path):
             self.connection_error.emit(f"Błąd: Plik {file_path} nie istnieje.")
-            return False
-            
-        try:
-            with open(file_path, 'rb') as docx_file:
-                file_data = base64.b64encode(docx_file.read()).decode()
-                
-            file_name = os.path.basename(file_path)
+            return None
             
-            return self.send_message('docx_file', {
-                'file_data': file_data,
-                'file_name': file_name
-            })
-        except Exception as e:
-            self.connection_error.emit(f"Błąd wysyłania pliku: {str(e)}")
-            return False
+        return self.connection.send_file(file_path, self.client_name, self.commands.room)
+    
+    def cancel_sending(self):
+        self.connection.cancel()
+    
+    def request_history(self, count):
+        return self.send_message('history', {'last': count})
+    
+    def request_document(self, document_id, offset=0):
+        return self.send_message('document_get', {'document_id': document_id, 'offset': offset})
     
     def stop(self):
-        self.running = False
-        if self.client:
-            try:
-                self.client.close()
-            except:
-                pass
+        self.connection.close()
+
+class MessageLogModel(QAbstractListModel):
+    def __init__(self, limit=2000):
+        super().__init__()
+        self.limit = limit
+        self.entries = []
+        
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.entries)
+        
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        text, is_error = self.entries[index.row()]
+        if role == Qt.DisplayRole:
+            return text
+        if role == Qt.ForegroundRole and is_error:
+            return QColor('red')
+        return None
+        
+    def append_entries(self, entries):
+        # One insert per batch; the oldest rows are dropped once the limit is reached
+        entries = entries[-self.limit:]
+        self.trim(self.limit - len(entries))
+        first = len(self.entries)
+        self.beginInsertRows(QModelIndex(), first, first + len(entries) - 1)
+        self.entries.extend(entries)
+        self.endInsertRows()
+        
+    def trim(self, keep):
+        excess = len(self.entries) - max(0, keep)
+        if excess > 0:
+            self.beginRemoveRows(QModelIndex(), 0, excess - 1)
+            del self.entries[:excess]
+            self.endRemoveRows()
+            
+    def set_limit(self, limit):
+        self.limit = limit
+        self.trim(limit)
+        
+    def clear(self):
+        self.beginResetModel()
+        self.entries = []
+        self.endResetModel()
 
 
 class ClientGUI(QMainWindow):
+    # Messages arriving within one interval are added to the view together
+    LOG_FLUSH_INTERVAL_MS = 50
+    
+
     def __init__(self):
         super().__init__()
         self.client_thread = None
+        # Documents announced by the server: id -> (label, offset of the next page)
+        self.documents = {}
+        self.pending_log = []
+        # Uploads queued or in progress: job id -> file name
+        self.uploads = {}
+        # What to log once a queued request has actually been sent: job id -> text
+        self.sent_notices = {}
         self.initUI()
         
     def initUI(self):
@@ -135,6 +195,10 @@ class ClientGUI(QMainWindow):
         self.port_input.setValue(8888)
         self.name_input = QLineEdit()
         self.connect_button = QPushButton("Połącz")
+        self.scrollback_input = QSpinBox()
+        self.scrollback_input.setRange(100, 100000)
+        self.scrollback_input.setSingleStep(500)
+        self.scrollback_input.setValue(2000)
         
         connection_layout.addWidget(QLabel("Host:"))
         connection_layout.addWidget(self.host_input)
@@ -143,29 +207,45 @@ class ClientGUI(QMainWindow):
         connection_layout.addWidget(QLabel("Nazwa:"))
         connection_layout.addWidget(self.name_input)
         connection_layout.addWidget(self.connect_button)
+        connection_layout.addWidget(QLabel("Historia:"))
+        connection_layout.addWidget(self.scrollback_input)
         
         main_layout.addLayout(connection_layout)
         
         splitter = QSplitter(Qt.Vertical)
         main_layout.addWidget(splitter, 1)
         
-        self.messages_area = QTextEdit()
-        self.messages_area.setReadOnly(True)
+        self.messages_model = MessageLogModel(self.scrollback_input.value())
+        self.messages_area = QListView()
+        self.messages_area.setModel(self.messages_model)
+        self.messages_area.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.messages_area.setSelectionMode(QAbstractItemView.ExtendedSelection)
+        self.messages_area.setVerticalScrollMode(QAbstractItemView.ScrollPerPixel)
+        self.messages_area.setHorizontalScrollMode(QAbstractItemView.ScrollPerPixel)
         fixed_font = QFont("Courier New")
         fixed_font.setStyleHint(QFont.Monospace)
         self.messages_area.setFont(fixed_font)
-        self.messages_area.setLineWrapMode(QTextEdit.NoWrap)
+        self.messages_area.setWordWrap(False)
         self.messages_area.setHorizontalScrollBarPolicy(Qt.ScrollBarAlwaysOn)
         splitter.addWidget(self.messages_area)
         
+        self.log_timer = QTimer(self)
+        self.log_timer.setSingleShot(True)
+        self.log_timer.setInterval(self.LOG_FLUSH_INTERVAL_MS)
+        self.log_timer.timeout.connect(self.flush_log)
+        
         control_widget = QWidget()
         control_layout = QVBoxLayout(control_widget)
         splitter.addWidget(control_widget)
         
         message_layout = QHBoxLayout()
         self.message_input = QLineEdit()
+        self.message_input.setToolTip(HELP)
+        self.message_input.setPlaceholderText("Tekst lub /join, /leave, /msg")
         self.send_message_button = QPushButton("Wyślij")
         
+        self.room_label = QLabel()
+        message_layout.addWidget(self.room_label)
         message_layout.addWidget(QLabel("Wiadomość:"))
         message_layout.addWidget(self.message_input, 1)
         message_layout.addWidget(self.send_message_button)
@@ -176,10 +256,14 @@ class ClientGUI(QMainWindow):
         
         self.send_image_button = QPushButton("Konwersja pliku do ASCII-art")
         self.send_docx_button = QPushButton("Wyślij plik DOCX")
+        self.get_document_button = QPushButton("Pobierz dokument")
+        self.history_button = QPushButton("Historia")
         self.clear_button = QPushButton("Wyczyść wiadomości")
         
         buttons_layout.addWidget(self.send_image_button)
         buttons_layout.addWidget(self.send_docx_button)
+        buttons_layout.addWidget(self.get_document_button)
+        buttons_layout.addWidget(self.history_button)
         buttons_layout.addWidget(self.clear_button)
         
         control_layout.addLayout(buttons_layout)
@@ -189,7 +273,20 @@ class ClientGUI(QMainWindow):
         self.message_input.returnPressed.connect(self.send_text_message)
         self.send_image_button.clicked.connect(self.send_image)
         self.send_docx_button.clicked.connect(self.send_docx)
+        self.get_document_button.clicked.connect(self.get_document)
+        self.history_button.clicked.connect(self.show_history)
         self.clear_button.clicked.connect(self.clear_messages)
+        self.scrollback_input.valueChanged.connect(self.messages_model.set_limit)
+        
+        self.upload_progress = QProgressBar()
+        self.upload_progress.setRange(0, 100)
+        self.upload_progress.setMaximumWidth(200)
+        self.cancel_upload_button = QPushButton("Anuluj wysyłanie")
+        self.cancel_upload_button.clicked.connect(self.cancel_uploads)
+        self.statusBar().addPermanentWidget(self.upload_progress)
+        self.statusBar().addPermanentWidget(self.cancel_upload_button)
+        self.upload_progress.hide()
+        self.cancel_upload_button.hide()
         
         self.toggle_controls(False)
         self.statusBar().showMessage("Nie połączono")
@@ -199,12 +296,15 @@ class ClientGUI(QMainWindow):
         self.send_message_button.setEnabled(enabled)
         self.send_image_button.setEnabled(enabled)
         self.send_docx_button.setEnabled(enabled)
+        self.get_document_button.setEnabled(enabled)
+        self.history_button.setEnabled(enabled)
         self.clear_button.setEnabled(enabled)
         
         self.host_input.setEnabled(not enabled)
         self.port_input.setEnabled(not enabled)
         self.name_input.setEnabled(not enabled)
         self.connect_button.setText("Rozłącz" if enabled else "Połącz")
+        self.update_room_label()
         
     def connect_to_server(self):
         if not self.client_thread:
@@ -216,18 +316,28 @@ class ClientGUI(QMainWindow):
                 QMessageBox.warning(self, "Błąd", "Proszę podać nazwę klienta")
                 return
                 
-            self.client_thread = ClientThread(host, port, name)
+            # "unix:/path" in the host field connects through the server's Unix socket
+            unix_path = host[len('unix:'):] if host.startswith('unix:') else None
+            self.client_thread = ClientThread(host, port, name, unix_path)
             self.client_thread.message_received.connect(self.handle_message)
             self.client_thread.connection_error.connect(self.handle_error)
+            self.client_thread.status_changed.connect(self.handle_status)
+            self.client_thread.history_reloading.connect(self.reload_history)
+            self.client_thread.send_progress.connect(self.handle_send_progress)
+            self.client_thread.send_finished.connect(self.handle_send_finished)
             self.client_thread.start()
             
-            self.statusBar().showMessage(f"Połączono jako: {name} do {host}:{port}")
+            self.statusBar().showMessage(f"Połączono jako: {name} do {unix_path or f'{host}:{port}'}")
             self.toggle_controls(True)
             self.log_message("System", f"Połączono do serwera jako: {name}")
         else:
             self.client_thread.stop()
             self.client_thread.wait()
             self.client_thread = None
+            self.uploads.clear()
+            self.sent_notices.clear()
+            self.upload_progress.hide()
+            self.cancel_upload_button.hide()
             
             self.statusBar().showMessage("Nie połączono")
             self.toggle_controls(False)
@@ -243,8 +353,14 @@ class ClientGUI(QMainWindow):
             
         success = self.client_thread.send_text_message(message)
         if success:
-            self.log_message(self.client_thread.client_name, message)
+            if not message.startswith('/'):
+                self.log_message(self.client_thread.client_name, message)
             self.message_input.clear()
+            self.update_room_label()
+            
+    def update_room_label(self):
+        room = self.client_thread.commands.room if self.client_thread else None
+        self.room_label.setText(f"[{room or 'ogólny'}]")
             
     def send_image(self):
         if not self.client_thread:
@@ -273,9 +389,9 @@ class ClientGUI(QMainWindow):
         if not ok:
             return
             
-        success = self.client_thread.send_image_request(file_path, width)
-        if success:
-            self.log_message("System", f"Wysłano żądanie konwersji obrazu: {os.path.basename(file_path)}")
+        job = self.client_thread.send_image_request(file_path, width)
+        if job:
+            self.sent_notices[job.job_id] = f"Wysłano żądanie konwersji obrazu: {os.path.basename(file_path)}"
             
     def send_docx(self):
         if not self.client_thread:
@@ -291,48 +407,159 @@ class ClientGUI(QMainWindow):
         if not file_path:
             return
             
-        success = self.client_thread.send_docx_file(file_path)
-        if success:
-            self.log_message("System", f"Wysłano plik DOCX: {os.path.basename(file_path)}")
+        job = self.client_thread.send_docx_file(file_path)
+        if job:
+            self.uploads[job.job_id] = job.description
+            self.sent_notices[job.job_id] = f"Wysłano plik DOCX: {job.description}"
+            self.upload_progress.setValue(0)
+            self.upload_progress.show()
+            self.cancel_upload_button.show()
+            self.log_message("System", f"Rozpoczęto wysyłanie pliku DOCX: {job.description}")
+            
+    def cancel_uploads(self):
+        if self.client_thread:
+            self.client_thread.cancel_sending()
+            
+    def handle_send_progress(self, job):
+        if job.job_id in self.uploads and job.total:
+            self.upload_progress.setValue(job.sent * 100 // job.total)
+            self.upload_progress.setFormat(f"{job.description}: %p%")
+            
+    def handle_send_finished(self, job):
+        self.uploads.pop(job.job_id, None)
+        notice = self.sent_notices.pop(job.job_id, None)
+        if not self.uploads:
+            self.upload_progress.hide()
+            self.cancel_upload_button.hide()
+            
+        if job.status == 'failed':
+            self.log_message("Błąd", f"Błąd wysyłania {job.description}: {job.error}", is_error=True)
+        elif job.status == 'cancelled':
+            self.log_message("System", f"Anulowano wysyłanie: {job.description}")
+        elif notice:
+            self.log_message("System", notice)
+            
+    def get_document(self):
+        if not self.client_thread:
+            return
+            
+        if not self.documents:
+            QMessageBox.information(self, "Dokumenty", "Serwer nie ogłosił jeszcze żadnego dokumentu.")
+            return
+            
+        ids = list(reversed(self.documents))
+        labels = [self.documents[document_id][0] for document_id in ids]
+        label, ok = QInputDialog.getItem(self, "Pobierz dokument", "Dokument:", labels, 0, False)
+        
+        if not ok:
+            return
+            
+        document_id = ids[labels.index(label)]
+        self.client_thread.request_document(document_id, self.documents[document_id][1])
+            
+    def show_history(self):
+        if not self.client_thread:
+            return
+            
+        count, ok = QInputDialog.getInt(self, "Historia wiadomości", "Liczba ostatnich wiadomości:", 50, 1, 1000)
+        if ok:
+            self.client_thread.request_history(count)
             
     def handle_message(self, response):
         response_type = response.get('type', '')
         
-        if response_type == 'ascii_response':
+        if response_type == 'ascii_response' and 'error' in response:
+            self.log_message("Serwer", response['error'])
+        elif response_type == 'ascii_response':
             ascii_art = response.get('data', '')
-            self.log_message("Serwer", "ASCII Art:", is_ascii=True)
-            cursor = self.messages_area.textCursor()
-            cursor.movePosition(QTextCursor.End)
-            self.messages_area.setTextCursor(cursor)
-            self.messages_area.insertPlainText("\n" + ascii_art + "\n")
+            self.log_message("Serwer", "ASCII Art:", block=ascii_art)
         elif response_type == 'docx_response':
             message = response.get('message', '')
             self.log_message("Serwer", message)
+        elif response_type == 'document_available':
+            document_id = response['document_id']
+            label = f"{response.get('file_name', '')} ({response.get('client_name', '')}, {document_id[:12]})"
+            self.documents[document_id] = (label, 0)
+            self.log_message("Serwer", response.get('message', ''))
+            self.log_message("Podgląd", response.get('preview', ''))
+        elif response_type == 'document_content':
+            self.show_document_page(response)
+        elif response_type == 'room':
+            if 'error' in response:
+                self.log_message("Serwer", response['error'], is_error=True)
+            else:
+                action = "Dołączono do pokoju" if response.get('joined') else "Opuszczono pokój"
+                self.log_message("System", f"{action} {response['room']} (osób: {response.get('members', 0)}). "
+                                           f"Twoje pokoje: {', '.join(response.get('rooms', []))}")
+        elif response_type == 'direct':
+            if 'error' in response:
+                self.log_message("Serwer", response['error'], is_error=True)
+            else:
+                self.log_message(f"prywatnie od {response.get('from')}", response.get('message', ''))
+        elif response_type == 'history':
+            if 'error' in response:
+                self.log_message("Serwer", response['error'], is_error=True)
+            else:
+                self.log_message("System", "----- Historia wiadomości -----")
+        elif response_type == 'history_end':
+            self.log_message("System", f"----- Koniec historii ({response.get('count', 0)} wiadomości) -----")
+        elif response_type == 'busy':
+            self.log_message("Serwer", response.get('message', "Serwer jest zajęty, spróbuj ponownie później."), is_error=True)
         elif response_type == 'text':
             message = response.get('message', '')
             self.log_message("Serwer", message)
         else:
             self.log_message("Serwer", str(response))
             
+    def show_document_page(self, response):
+        if 'error' in response:
+            self.log_message("Serwer", response['error'], is_error=True)
+            return
+            
+        document_id = response['document_id']
+        end = response['offset'] + response['length']
+        if document_id in self.documents:
+            # Repeated requests page through the document, then start over
+            label = self.documents[document_id][0]
+            self.documents[document_id] = (label, end if end < response['total'] else 0)
+            
+        self.log_message("Serwer", f"Treść dokumentu (znaki {response['offset']}-{end} z {response['total']}):",
+                         block=response['text'])
+        
+    def handle_status(self, status):
+        self.statusBar().showMessage(status)
+        self.log_message("System", status)
+        
     def handle_error(self, error_message):
         self.log_message("Błąd", error_message, is_error=True)
         
-    def log_message(self, sender, message, is_error=False, is_ascii=False):
-        cursor = self.messages_area.textCursor()
-        cursor.movePosition(QTextCursor.End)
-        self.messages_area.setTextCursor(cursor)
-        
-        if is_ascii:
-            self.messages_area.append(f"<b>[{sender}]:</b>")
-            return
+    def log_message(self, sender, message, is_error=False, block=None):
+        text = f"[{sender}]: {message}"
+        if block is not None:
+            text += "\n" + block
+        self.pending_log.append((text, is_error))
+        if not self.log_timer.isActive():
+            self.log_timer.start()
             
-        if is_error:
-            self.messages_area.append(f"<span style='color: red'><b>[{sender}]:</b> {message}</span>")
-        else:
-            self.messages_area.append(f"<b>[{sender}]:</b> {message}")
+    def flush_log(self):
+        if not self.pending_log:
+            return
+        # Follow new messages only when the user hasn't scrolled up to read older ones
+        scrollbar = self.messages_area.verticalScrollBar()
+        at_bottom = scrollbar.value() >= scrollbar.maximum()
+        entries, self.pending_log = self.pending_log, []
+        self.messages_model.append_entries(entries)
+        if at_bottom:
+            self.messages_area.scrollToBottom()
             
+    def reload_history(self):
+        self.pending_log = []
+        self.messages_model.clear()
+        self.log_message("System", "Połączono ponownie, wczytywanie historii wiadomości od nowa")
+        
     def clear_messages(self):
-        self.messages_area.clear()
+        self.pending_log = []
+        self.messages_model.clear()
         self.log_message("System", "Wyczyszczono historię wiadomości")
         
     def closeEvent(self, event):
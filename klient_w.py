@@ -1,4 +1,4 @@
-import socket
+import argparse
 import threading
 import json
 import os
@@ -7,50 +7,146 @@ import base64
 from PIL import Image
 import io
 from tkinter import Tk, filedialog
+from polaczenie import Connection
+from obrazy import prescale_image
+from polecenia import HELP, ChatCommands
 
-def receive_messages(client, client_name):
-    while True:
-        try:
-            response = client.recv(4096)
-            if not response:
-                break
-                
-            try:
-                json_response = json.loads(response.decode())
-                if json_response.get('type') == 'ascii_response':
-                    print("\nOdpowiedź serwera dla", client_name + ":")
-                    print(json_response.get('data', 'No data received'))
-                elif json_response.get('type') == 'docx_response':
-                    print(f"\nOdpowiedź serwera dla {client_name}: {json_response.get('message', 'Brak wiadomości')}")
-                else:
-                    print(f"\nOdpowiedź serwera dla {client_name}: {json_response}")
-            except json.JSONDecodeError:
-                print(f"\nOdpowiedź serwera dla {client_name}: {response.decode()}")
-        except Exception as e:
-            print(f"Błąd odbioru dla {client_name}: {str(e)}")
-            break
-
-def send_image_request(client, image_path, width, client_name):
+# Documents announced by the server: id -> offset of the next page to fetch
+documents = {}
+last_document = [None]
+# Filled from the server's welcome message; older servers don't send one
+server_capabilities = set()
+
+def handle_message(connection, json_response, commands):
+    client_name = commands.client_name
+    if json_response.get('type') == 'welcome':
+        server_capabilities.clear()
+        server_capabilities.update(json_response.get('capabilities', []))
+        # After a reconnect the server has forgotten the room this client was in. The join is
+        # sent even without one, since it is what claims the name that direct messages use
+        room = commands.room if commands.room is not None else json_response.get('room', 'ogólny')
+        connection.send_message({'type': 'join', 'room': room, 'client_name': client_name})
+    elif json_response.get('type') == 'ascii_response' and 'error' in json_response:
+        print(f"\nOdpowiedź serwera dla {client_name}: {json_response['error']}")
+    elif json_response.get('type') == 'ascii_response':
+        print("\nOdpowiedź serwera dla", client_name + ":")
+        print(json_response.get('data', 'No data received'))
+    elif json_response.get('type') == 'stats_response':
+        print(f"\nStatystyki serwera dla {client_name}:")
+        print(json.dumps(json_response.get('data', {}), indent=2, ensure_ascii=False))
+    elif json_response.get('type') == 'docx_response':
+        print(f"\nOdpowiedź serwera dla {client_name}: {json_response.get('message', 'Brak wiadomości')}")
+    elif json_response.get('type') == 'document_available':
+        document_id = json_response['document_id']
+        documents.setdefault(document_id, 0)
+        last_document[0] = document_id
+        print(f"\n{json_response.get('message', '')}")
+        print(f"Podgląd ({json_response.get('text_length', 0)} znaków, id {document_id[:12]}):")
+        print(json_response.get('preview', ''))
+    elif json_response.get('type') == 'document_content':
+        show_document_page(json_response, client_name)
+    elif json_response.get('type') == 'room':
+        if 'error' in json_response:
+            print(f"\nOdpowiedź serwera dla {client_name}: {json_response['error']}")
+        else:
+            action = "Dołączono do pokoju" if json_response.get('joined') else "Opuszczono pokój"
+            print(f"\n{action} {json_response['room']} (osób: {json_response.get('members', 0)}). "
+                  f"Twoje pokoje: {', '.join(json_response.get('rooms', []))}")
+    elif json_response.get('type') == 'direct':
+        if 'error' in json_response:
+            print(f"\nOdpowiedź serwera dla {client_name}: {json_response['error']}")
+        else:
+            print(f"\n[prywatnie od {json_response.get('from')}]: {json_response.get('message', '')}")
+    elif json_response.get('type') == 'history':
+        if 'error' in json_response:
+            print(f"\nOdpowiedź serwera dla {client_name}: {json_response['error']}")
+        else:
+            print("\n===== HISTORIA WIADOMOŚCI =====")
+    elif json_response.get('type') == 'busy':
+        print(f"\nSerwer zajęty ({client_name}): {json_response.get('message', 'spróbuj ponownie później')}")
+    elif json_response.get('type') == 'history_end':
+        print(f"===== KONIEC HISTORII ({json_response.get('count', 0)} wiadomości) =====")
+    else:
+        print(f"\nOdpowiedź serwera dla {client_name}: {json_response}")
+
+def show_document_page(response, client_name):
+    if 'error' in response:
+        print(f"\nOdpowiedź serwera dla {client_name}: {response['error']}")
+        return
+    end = response['offset'] + response['length']
+    documents[response['document_id']] = end if end < response['total'] else 0
+    print(f"\nTreść dokumentu (znaki {response['offset']}-{end} z {response['total']}):\n")
+    print(response['text'])
+
+def request_document(sender, client_name):
+    default = last_document[0]
+    prompt = f"[{client_name}] Podaj id dokumentu" + (f" (domyślnie {default[:12]}): " if default else ": ")
+    document_id = input(prompt).strip()
+    if document_id:
+        # Announcements show a shortened id, so accept any unique prefix of a known one
+        matches = [known for known in documents if known.startswith(document_id)]
+        if len(matches) == 1:
+            document_id = matches[0]
+    else:
+        document_id = default
+    if not document_id:
+        print("Brak dokumentów do pobrania.")
+        return
+    sender.send_message({
+        'type': 'document_get',
+        'document_id': document_id,
+        'offset': documents.get(document_id, 0),
+        'client_name': client_name
+    })
+
+def make_connection(host, port, commands, unix_path=None):
+    client_name = commands.client_name
+
+    def on_progress(job):
+        # Every tenth of the file is enough for a console
+        percent = job.sent * 100 // job.total if job.total else 100
+        if percent // 10 != getattr(job, 'reported', -1):
+            job.reported = percent // 10
+            print(f"[{client_name}] Wysyłanie {job.description}: {percent}%")
+
+    def on_finished(job):
+        if job.status == 'failed':
+            print(f"Błąd wysyłania dla {client_name}: {job.error}")
+        elif job.status == 'cancelled':
+            print(f"[{client_name}] Anulowano wysyłanie: {job.description}")
+        elif job.kind == 'file':
+            print(f"Wysłano plik DOCX: {job.description} od {client_name}")
+
+    connection = Connection(host, port, lambda message: handle_message(connection, message, commands),
+                            on_status=lambda status: print(f"\n[{client_name}] {status}"),
+                            on_progress=on_progress, on_finished=on_finished, unix_path=unix_path)
+    return connection
+
+def send_image_request(sender, image_path, width, client_name):
     if not os.path.exists(image_path):
         print(f"Błąd: Plik {image_path} nie istnieje.")
         return
         
     try:
         with open(image_path, 'rb') as img_file:
-            img_data = base64.b64encode(img_file.read()).decode()
+            image_bytes = img_file.read()
             
         request = {
             'type': 'image_to_ascii',
-            'image_data': img_data,
             'width': width,
             'client_name': client_name
         }
-        client.send(json.dumps(request).encode())
+        if 'image_prescaled' in server_capabilities:
+            # Send only the pixels the server needs for this width
+            image_bytes = prescale_image(image_bytes, width)
+            request['prescaled'] = True
+        request['image_data'] = base64.b64encode(image_bytes).decode()
+        sender.send_message(request)
         print(f"Wysłano żądanie konwersji obrazu od {client_name}: {image_path}")
     except Exception as e:
         print(f"Błąd wysyłania dla {client_name}: {str(e)}")
 
-def send_docx_file(client, client_name):
+def send_docx_file(sender, client_name, room=None):
     root = Tk()
     root.withdraw()
     
@@ -69,42 +165,30 @@ def send_docx_file(client, client_name):
         print(f"Błąd: Plik {file_path} nie istnieje.")
         return
         
-    try:
-        with open(file_path, 'rb') as docx_file:
-            file_data = base64.b64encode(docx_file.read()).decode()
-            
-        file_name = os.path.basename(file_path)
-        
-        request = {
-            'type': 'docx_file',
-            'file_data': file_data,
-            'file_name': file_name,
-            'client_name': client_name
-        }
-        
-        json_data = json.dumps(request)
-        client.send(json_data.encode())
-        print(f"Wysłano plik DOCX: {file_name} od {client_name}")
-    except Exception as e:
-        print(f"Błąd wysyłania pliku dla {client_name}: {str(e)}")
+    # Sent in the background; progress and the result are printed by the sender
+    sender.send_file(file_path, client_name, room)
 
-def send_message(client, client_name):
+def send_message(sender, commands):
+    client_name = commands.client_name
     while True:
         print(f"\n[{client_name}] Wybierz opcję:")
-        print("1. Wyślij wiadomość tekstową")
+        print(f"1. Wyślij wiadomość tekstową lub polecenie (pokój: {commands.room or 'domyślny'})")
         print("2. Konwertuj obraz na ASCII art")
         print("3. Wyślij plik DOCX")
+        print("4. Pokaż statystyki serwera")
+        print("5. Pobierz treść dokumentu")
+        print("6. Anuluj wysyłanie plików")
+        print("7. Pokaż historię wiadomości")
         
-        choice = input(f"[{client_name}] Twój wybór (1/2/3): ")
+        choice = input(f"[{client_name}] Twój wybór (1/2/3/4/5/6/7): ")
         
         if choice == '1':
+            print(HELP)
             message = input(f"[{client_name}] Wpisz wiadomość: ")
-            request = {
-                'type': 'text',
-                'message': message,
-                'client_name': client_name
-            }
-            client.send(json.dumps(request).encode())
+            try:
+                sender.send_message(commands.parse(message))
+            except ValueError as e:
+                print(str(e))
         elif choice == '2':
             image_path = 'emoji.png'
             
@@ -125,23 +209,38 @@ def send_message(client, client_name):
                 
             width_input = input(f"[{client_name}] Podaj szerokość ASCII art (domyślnie {suggested_width}): ")
             width = int(width_input) if width_input.isdigit() else suggested_width
-            send_image_request(client, image_path, width, client_name)
+            send_image_request(sender, image_path, width, client_name)
         elif choice == '3':
-            send_docx_file(client, client_name)
+            send_docx_file(sender, client_name, commands.room)
+        elif choice == '4':
+            sender.send_message({'type': 'stats', 'client_name': client_name})
+        elif choice == '5':
+            request_document(sender, client_name)
+        elif choice == '6':
+            sender.cancel()
+        elif choice == '7':
+            count_input = input(f"[{client_name}] Ile ostatnich wiadomości pokazać (domyślnie 20): ")
+            count = int(count_input) if count_input.isdigit() else 20
+            sender.send_message({'type': 'history', 'last': count, 'client_name': client_name})
         else:
             print("Nieprawidłowy wybór. Spróbuj ponownie.")
 
 def main():
-    client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    client.connect(('localhost', 8888))
+    parser = argparse.ArgumentParser(description="Klient konsolowy")
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=8888)
+    parser.add_argument('--unix', default=None, metavar='ŚCIEŻKA',
+                        help="Połącz przez gniazdo Unix serwera (--unix-socket) zamiast TCP")
+    args = parser.parse_args()
 
     client_name = input("Podaj swoją nazwę: ")
-    print(f"Połączono jako: {client_name}")
+    commands = ChatCommands(client_name)
 
-    receive_thread = threading.Thread(target=receive_messages, args=(client, client_name))
-    receive_thread.start()
+    # Connects in the background and keeps reconnecting if the server goes away
+    connection = make_connection(args.host, args.port, commands, args.unix)
+    threading.Thread(target=connection.run, daemon=True).start()
 
-    send_message(client, client_name)
+    send_message(connection, commands)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,87 @@
+import threading
+import time
+
+class ServerBusy(Exception):
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        # rate in tokens per second; a full bucket allows a burst of requests at once
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+    def take(self):
+        # 0 when a token was taken, otherwise the seconds until one will be there
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+class RateLimits:
+    def __init__(self, limits):
+        # limits: request type -> (requests per minute, burst); each client gets its own buckets
+        self.limits = {name: limit for name, limit in limits.items() if limit[0] > 0}
+        self.allowed = {}
+        self.limited = {}
+        self._lock = threading.Lock()
+
+    def check(self, buckets, request_type):
+        # buckets is the client's own dict, kept on the connection
+        limit = self.limits.get(request_type)
+        if limit is None:
+            return 0.0
+        with self._lock:
+            bucket = buckets.get(request_type)
+            if bucket is None:
+                per_minute, burst = limit
+                bucket = buckets[request_type] = TokenBucket(per_minute / 60, max(1, burst))
+            wait = bucket.take()
+            counters = self.limited if wait else self.allowed
+            counters[request_type] = counters.get(request_type, 0) + 1
+        return wait
+
+    def stats(self):
+        with self._lock:
+            return {
+                'limits': {name: {'per_minute': per_minute, 'burst': burst}
+                           for name, (per_minute, burst) in self.limits.items()},
+                'allowed': dict(self.allowed),
+                'limited': dict(self.limited),
+                'allowed_total': sum(self.allowed.values()),
+                'limited_total': sum(self.limited.values()),
+            }
+
+class ConcurrencyLimit:
+    def __init__(self, limit):
+        self.limit = limit
+        self.active = 0
+        self.peak = 0
+        self.rejected = 0
+        self._condition = threading.Condition()
+
+    def acquire(self, wait=True):
+        with self._condition:
+            if self.active >= self.limit:
+                if not wait:
+                    self.rejected += 1
+                    return False
+                self._condition.wait_for(lambda: self.active < self.limit)
+            self.active += 1
+            self.peak = max(self.peak, self.active)
+            return True
+
+    def release(self):
+        with self._condition:
+            self.active -= 1
+            self._condition.notify()
+
+    def stats(self):
+        with self._condition:
+            return {'limit': self.limit, 'active': self.active, 'peak': self.peak, 'rejected': self.rejected}
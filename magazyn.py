@@ -0,0 +1,112 @@
+import datetime
+import json
+import os
+import tempfile
+import threading
+
+from pamiec_podreczna import LRUCache
+
+class BlobStore:
+    def __init__(self, root, text_cache_entries=128, text_cache_bytes=32 * 1024 * 1024):
+        self.root = root
+        self.temp_dir = os.path.join(root, 'tmp')
+        os.makedirs(self.temp_dir, exist_ok=True)
+        self.text_cache = LRUCache(text_cache_entries, text_cache_bytes)
+        self.stored = 0
+        self.duplicates = 0
+        self.manifest_refs = 0
+        self._lock = threading.Lock()
+
+    def blob_path(self, digest):
+        return os.path.join(self.root, digest[:2], f"{digest}.docx")
+
+    def text_path(self, digest):
+        return os.path.join(self.root, digest[:2], f"{digest}.txt")
+
+    def contains(self, digest):
+        return os.path.exists(self.blob_path(digest))
+
+    def new_temp_path(self):
+        fd, path = tempfile.mkstemp(suffix='.part', dir=self.temp_dir)
+        os.close(fd)
+        return path
+
+    def put_file(self, temp_path, digest):
+        # temp_path lives under root, so adding it to the store is a rename
+        path = self.blob_path(digest)
+        if os.path.exists(path):
+            os.remove(temp_path)
+            self.count_duplicate()
+            return path
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(temp_path, path)
+        with self._lock:
+            self.stored += 1
+        return path
+
+    def count_duplicate(self):
+        with self._lock:
+            self.duplicates += 1
+
+    def link(self, digest, dest_path):
+        # The per-client timestamped name is just another name for the blob; where
+        # hard links aren't available it is recorded in the folder's manifest instead
+        base, ext = os.path.splitext(dest_path)
+        candidate = dest_path
+        suffix = 1
+        while True:
+            try:
+                os.link(self.blob_path(digest), candidate)
+                return candidate
+            except FileExistsError:
+                if os.path.samefile(self.blob_path(digest), candidate):
+                    return candidate
+                candidate = f"{base}_{suffix}{ext}"
+                suffix += 1
+            except OSError:
+                self._add_manifest_entry(digest, candidate)
+                return candidate
+
+    def _add_manifest_entry(self, digest, dest_path):
+        entry = {
+            'name': os.path.basename(dest_path),
+            'sha256': digest,
+            'blob': os.path.relpath(self.blob_path(digest), os.path.dirname(dest_path)),
+            'time': datetime.datetime.now().isoformat(timespec='seconds')
+        }
+        with self._lock:
+            with open(os.path.join(os.path.dirname(dest_path), 'manifest.jsonl'), 'a', encoding='utf-8') as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            self.manifest_refs += 1
+
+    def cached_text(self, digest):
+        text = self.text_cache.get(digest)
+        if text is not None:
+            return text
+        try:
+            with open(self.text_path(digest), encoding='utf-8') as f:
+                text = f.read()
+        except OSError:
+            return None
+        self.text_cache.put(digest, text)
+        return text
+
+    def save_text(self, digest, text):
+        path = self.text_path(digest)
+        temp_path = self.new_temp_path()
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            f.write(text)
+        os.replace(temp_path, path)
+        self.text_cache.put(digest, text)
+
+    def stats(self):
+        with self._lock:
+            data = {
+                'stored': self.stored,
+                'duplicates': self.duplicates,
+                'manifest_refs': self.manifest_refs,
+            }
+        cache = self.text_cache.stats()
+        data['text_cache_hits'] = cache['hits']
+        data['text_cache_misses'] = cache['misses']
+        return data
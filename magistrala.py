@@ -0,0 +1,142 @@
+import socket
+import struct
+import threading
+
+# Each bus message is a length prefix, then a topic (its own length and UTF-8 name)
+# and an already encoded frame
+LENGTH = struct.Struct('!I')
+TOPIC_LENGTH = struct.Struct('!H')
+
+def _read_exact(sock, size):
+    data = bytearray()
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            return None
+        data += chunk
+    return bytes(data)
+
+def _read_messages(sock):
+    while True:
+        header = _read_exact(sock, LENGTH.size)
+        if header is None:
+            return
+        data = _read_exact(sock, LENGTH.unpack(header)[0])
+        if data is None:
+            return
+        yield data
+
+class BusHub:
+    # Runs in the parent process; every message a server process publishes is
+    # forwarded to all the other server processes
+    def __init__(self, path):
+        self.path = path
+        self.members = {}
+        self._lock = threading.Lock()
+        self.server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.server.bind(path)
+        self.server.listen()
+
+    def start(self):
+        # Separate from __init__ so the server processes can be forked before any thread exists
+        threading.Thread(target=self._accept_loop, name='magistrala', daemon=True).start()
+
+    def _accept_loop(self):
+        while True:
+            try:
+                member, _ = self.server.accept()
+            except OSError:
+                return
+            with self._lock:
+                self.members[member] = threading.Lock()
+            threading.Thread(target=self._forward_loop, args=(member,), daemon=True).start()
+
+    def _forward_loop(self, member):
+        try:
+            for data in _read_messages(member):
+                message = LENGTH.pack(len(data)) + data
+                with self._lock:
+                    others = [(sock, lock) for sock, lock in self.members.items() if sock is not member]
+                for sock, lock in others:
+                    try:
+                        with lock:
+                            sock.sendall(message)
+                    except OSError:
+                        pass
+        except OSError:
+            pass
+        finally:
+            with self._lock:
+                self.members.pop(member, None)
+            member.close()
+
+    def close(self):
+        self.server.close()
+        with self._lock:
+            members = list(self.members)
+        for member in members:
+            try:
+                member.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+class BusClient:
+    # deliver(topic, data) is called on the bus thread for every frame published by another process
+    def __init__(self, path, deliver):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(path)
+        self.deliver = deliver
+        self.published = 0
+        self.received = 0
+        self._lock = threading.Lock()
+        threading.Thread(target=self._receive_loop, name='magistrala', daemon=True).start()
+
+    def publish(self, data, topic=''):
+        topic = topic.encode('utf-8')
+        header = TOPIC_LENGTH.pack(len(topic)) + topic
+        with self._lock:
+            self.sock.sendall(LENGTH.pack(len(header) + len(data)) + header + data)
+            self.published += 1
+
+    def _receive_loop(self):
+        try:
+            for data in _read_messages(self.sock):
+                self.received += 1
+                topic_length = TOPIC_LENGTH.unpack_from(data)[0]
+                start = TOPIC_LENGTH.size + topic_length
+                self.deliver(data[TOPIC_LENGTH.size:start].decode('utf-8'), data[start:])
+        except OSError:
+            pass
+
+    def close(self):
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
+
+    def stats(self):
+        return {'published': self.published, 'received': self.received}
+
+class RemoteNames:
+    # Client names in use at the other server processes, kept per process from the
+    # announcements they publish, so a direct message to nobody can be refused at once
+    def __init__(self):
+        self._names = {}
+        self._lock = threading.Lock()
+
+    def update(self, origin, name, claimed):
+        with self._lock:
+            names = self._names.setdefault(origin, set())
+            if claimed:
+                names.add(name)
+            else:
+                names.discard(name)
+
+    def __contains__(self, name):
+        with self._lock:
+            return any(name in names for names in self._names.values())
+
+    def __len__(self):
+        with self._lock:
+            return sum(len(names) for names in self._names.values())
@@ -0,0 +1,168 @@
+import bisect
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Upper bounds in seconds; the last bucket catches everything else
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, float('inf'))
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.sum += value
+
+    def quantile(self, fraction, counts, count):
+        # Upper bound of the bucket holding the requested rank
+        if not count:
+            return None
+        rank = fraction * count
+        seen = 0
+        for bound, bucket_count in zip(self.buckets, counts):
+            seen += bucket_count
+            if seen >= rank:
+                return bound
+        return self.buckets[-1]
+
+    def snapshot(self):
+        with self._lock:
+            counts = list(self.counts)
+            count = self.count
+            total = self.sum
+        return {
+            'count': count,
+            'sum': total,
+            'mean': total / count if count else None,
+            'p50': self.quantile(0.50, counts, count),
+            'p95': self.quantile(0.95, counts, count),
+            'p99': self.quantile(0.99, counts, count),
+            'buckets': counts,
+        }
+
+class Metrics:
+    def __init__(self, request_types=()):
+        self.started = time.time()
+        self.request_types = set(request_types)
+        self.requests = {}
+        self.broadcast = Histogram()
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.connections_total = 0
+        self.broadcast_recipients = 0
+        self._sources = {}
+        self._lock = threading.Lock()
+
+    def _label(self, request_type):
+        # Unknown types share one label so clients can't grow the table without bound
+        return request_type if request_type in self.request_types else 'other'
+
+    def observe_request(self, request_type, seconds):
+        label = self._label(request_type)
+        histogram = self.requests.get(label)
+        if histogram is None:
+            with self._lock:
+                histogram = self.requests.setdefault(label, Histogram())
+        histogram.observe(seconds)
+
+    def observe_broadcast(self, seconds, recipients):
+        self.broadcast.observe(seconds)
+        with self._lock:
+            self.broadcast_recipients += recipients
+
+    def add_bytes_in(self, count):
+        with self._lock:
+            self.bytes_in += count
+
+    def add_bytes_out(self, count):
+        with self._lock:
+            self.bytes_out += count
+
+    def connection_opened(self):
+        with self._lock:
+            self.connections_total += 1
+
+    def register_source(self, name, func):
+        # func returns a dict of numbers, evaluated only when stats are requested
+        self._sources[name] = func
+
+    def snapshot(self):
+        with self._lock:
+            data = {
+                'uptime_s': time.time() - self.started,
+                'bytes_in': self.bytes_in,
+                'bytes_out': self.bytes_out,
+                'connections_total': self.connections_total,
+                'broadcast_recipients': self.broadcast_recipients,
+            }
+        data['requests'] = {name: histogram.snapshot() for name, histogram in list(self.requests.items())}
+        data['broadcast'] = self.broadcast.snapshot()
+        for name, func in list(self._sources.items()):
+            try:
+                data[name] = func()
+            except Exception as e:
+                data[name] = {'error': str(e)}
+        return data
+
+def _format_bound(bound):
+    return '+Inf' if bound == float('inf') else repr(bound)
+
+def _histogram_lines(name, histogram, snapshot, labels=''):
+    lines = []
+    cumulative = 0
+    separator = ',' if labels else ''
+    for bound, count in zip(histogram.buckets, snapshot['buckets']):
+        cumulative += count
+        lines.append(f'{name}_bucket{{{labels}{separator}le="{_format_bound(bound)}"}} {cumulative}')
+    suffix = f'{{{labels}}}' if labels else ''
+    lines.append(f'{name}_sum{suffix} {snapshot["sum"]}')
+    lines.append(f'{name}_count{suffix} {snapshot["count"]}')
+    return lines
+
+def to_prometheus(metrics, prefix='serwer'):
+    snapshot = metrics.snapshot()
+    lines = [f'# TYPE {prefix}_request_duration_seconds histogram']
+    for name, data in sorted(snapshot['requests'].items()):
+        lines += _histogram_lines(f'{prefix}_request_duration_seconds', metrics.requests[name], data, f'type="{name}"')
+    lines.append(f'# TYPE {prefix}_broadcast_duration_seconds histogram')
+    lines += _histogram_lines(f'{prefix}_broadcast_duration_seconds', metrics.broadcast, snapshot['broadcast'])
+    counters = (('bytes_in', 'received_bytes_total'), ('bytes_out', 'sent_bytes_total'),
+                ('connections_total', 'connections_total'), ('broadcast_recipients', 'broadcast_recipients_total'))
+    for key, name in counters:
+        lines.append(f'# TYPE {prefix}_{name} counter')
+        lines.append(f'{prefix}_{name} {snapshot[key]}')
+    lines.append(f'{prefix}_uptime_seconds {snapshot["uptime_s"]}')
+    for source in metrics._sources:
+        for key, value in snapshot.get(source, {}).items():
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                lines.append(f'{prefix}_{source}_{key} {value}')
+    return '\n'.join(lines) + '\n'
+
+def start_http_endpoint(metrics, port, host='127.0.0.1'):
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path not in ('/', '/metrics'):
+                self.send_error(404)
+                return
+            body = to_prometheus(metrics).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -0,0 +1,24 @@
+import io
+
+from PIL import Image
+
+# Rows of ASCII art; a very tall image is squeezed rather than rendered without bound
+MAX_ASCII_HEIGHT = 400
+
+def ascii_grid_size(image_size, width):
+    # Characters are about twice as tall as wide, hence the 0.5
+    orig_width, orig_height = image_size
+    aspect_ratio = orig_height / orig_width
+    return width, min(int(aspect_ratio * width * 0.5), MAX_ASCII_HEIGHT)
+
+def ascii_pixels(image, width, height):
+    return image.resize((width, height)).convert('L')
+
+def prescale_image(image_bytes, width):
+    # The grayscale character grid the server would compute itself, as a lossless PNG;
+    # resizing it to its own size is a copy, so the server renders identical ASCII art
+    with Image.open(io.BytesIO(image_bytes)) as image:
+        grid = ascii_pixels(image, *ascii_grid_size(image.size, width))
+    output = io.BytesIO()
+    grid.save(output, 'PNG', optimize=True)
+    return output.getvalue()
@@ -0,0 +1,169 @@
+import socket
+import threading
+import time
+
+from protokol import CODECS, MessageReader, ProtocolError, configure_keepalive, encode_binary_message
+from wysylanie import Sender
+
+HEARTBEAT_INTERVAL = 15.0
+IDLE_TIMEOUT = 45.0
+CONNECT_TIMEOUT = 10.0
+RECONNECT_DELAY = 1.0
+MAX_RECONNECT_DELAY = 30.0
+
+class Connection:
+    # A client connection that answers heartbeats, notices a silent server and
+    # reconnects with growing delays. run() blocks, so callers give it a thread;
+    # the callbacks are called on that thread (on_progress / on_finished on the sender's)
+    def __init__(self, host, port, on_message, on_status=None, on_progress=None, on_finished=None,
+                 heartbeat_interval=HEARTBEAT_INTERVAL, idle_timeout=IDLE_TIMEOUT, compression=True, binary=True,
+                 unix_path=None):
+        self.host = host
+        self.port = port
+        # With unix_path the server's Unix socket is used instead of host and port
+        self.unix_path = unix_path
+        self.address = unix_path or f"{host}:{port}"
+        self.on_message = on_message
+        self.on_status = on_status or (lambda text: None)
+        self.on_progress = on_progress
+        self.on_finished = on_finished
+        self.heartbeat_interval = heartbeat_interval
+        self.idle_timeout = idle_timeout
+        self.compression = compression
+        # With binary=False the connection stays on JSON, which is easier to inspect
+        self.binary = binary
+        self.encoding = 'json'
+        # Codec the server agreed to use for this connection; decompression itself is
+        # done by MessageReader for any frame flagged as compressed
+        self.codec = None
+        self.sender = None
+        self.sock = None
+        self.running = True
+        self._stopped = threading.Event()
+
+    def run(self):
+        delay = RECONNECT_DELAY
+        while self.running:
+            try:
+                sock = self._connect()
+            except OSError as e:
+                self.on_status(f"Nie można połączyć z serwerem: {str(e)}. Ponowna próba za {delay:.0f} s")
+                self._stopped.wait(delay)
+                delay = min(delay * 2, MAX_RECONNECT_DELAY)
+                continue
+            delay = RECONNECT_DELAY
+            # Blocking: the sender's sendall of a large upload chunk must not time out
+            # halfway through a frame. Reads are bounded by select in _read_loop instead
+            sock.settimeout(None)
+            self.sock = sock
+            self.sender = Sender(sock, self.on_progress, self.on_finished)
+            self.on_status(f"Połączono z serwerem {self.address}")
+            try:
+                self._read_loop(sock)
+                reason = "serwer zamknął połączenie"
+            except (OSError, ProtocolError) as e:
+                reason = str(e)
+            finally:
+                sender, self.sender = self.sender, None
+                self._close_socket(sock)
+                sender.close()
+            if self.running:
+                self.on_status(f"Utracono połączenie ({reason}), ponowne łączenie...")
+
+    def _connect(self):
+        if self.unix_path is None:
+            sock = socket.create_connection((self.host, self.port), timeout=CONNECT_TIMEOUT)
+            configure_keepalive(sock)
+            return sock
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(CONNECT_TIMEOUT)
+        try:
+            sock.connect(self.unix_path)
+        except OSError:
+            sock.close()
+            raise
+        return sock
+
+    def _read_loop(self, sock):
+        reader = MessageReader(sock)
+        last_seen = time.monotonic()
+        while self.running:
+            try:
+                # Wakes up at least once per interval to check on the server
+                message = reader.read_message(self.heartbeat_interval)
+            except socket.timeout:
+                if time.monotonic() - last_seen > self.idle_timeout:
+                    raise ConnectionError("serwer nie odpowiada")
+                self.sender.send_message({'type': 'ping'})
+                continue
+            if message is None:
+                return
+            last_seen = time.monotonic()
+            if message.get('type') == 'ping':
+                self.sender.send_message({'type': 'pong'})
+            elif message.get('type') == 'compression':
+                self.codec = message.get('codec')
+            elif message.get('type') == 'encoding':
+                self.encoding = message.get('encoding', 'json')
+                if self.encoding == 'binary':
+                    self.sender.encode = encode_binary_message
+            elif message.get('type') != 'pong':
+                if message.get('type') == 'welcome':
+                    self._negotiate(message)
+                try:
+                    self.on_message(message)
+                except Exception as e:
+                    self.on_status(f"Błąd obsługi wiadomości: {str(e)}")
+
+    def _negotiate(self, welcome):
+        # Sent before the welcome is handed on, so the replies to whatever the client
+        # asks for in response already come in the agreed form
+        self.codec = None
+        offered = welcome.get('compression', []) if self.compression else []
+        codec = next((codec for codec in offered if codec in CODECS), None)
+        if codec is not None:
+            self.sender.send_message({'type': 'compression', 'codec': codec})
+        self.encoding = 'json'
+        if self.binary and 'binary' in welcome.get('encodings', []):
+            self.sender.send_message({'type': 'encoding', 'encoding': 'binary'})
+
+    def _close_socket(self, sock):
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        sock.close()
+
+    def send_message(self, message, description=None):
+        # None while disconnected
+        sender = self.sender
+        if sender is None:
+            self.on_status("Brak połączenia z serwerem, nie wysłano.")
+            return None
+        return sender.send_message(message, description)
+
+    def send_file(self, file_path, client_name, room=None):
+        sender = self.sender
+        if sender is None:
+            self.on_status("Brak połączenia z serwerem, nie wysłano.")
+            return None
+        return sender.send_file(file_path, client_name, room)
+
+    def cancel(self, job_id=None):
+        sender = self.sender
+        if sender:
+            sender.cancel(job_id)
+
+    def close(self):
+        self.running = False
+        self._stopped.set()
+        sender = self.sender
+        if sender:
+            sender.cancel()
+        sock = self.sock
+        if sock is not None:
+            # Wakes the reading thread, which then cleans up
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
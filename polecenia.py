@@ -0,0 +1,33 @@
+HELP = ("/join <pokój> – dołącz do pokoju i pisz w nim, /leave <pokój> – opuść pokój, "
+        "/msg <nazwa> <treść> – wiadomość prywatna")
+
+class ChatCommands:
+    # Turns a line typed in a client into a request; plain text goes to the current room
+    def __init__(self, client_name):
+        self.client_name = client_name
+        # None means the server's default room
+        self.room = None
+
+    def parse(self, text):
+        if not text.startswith('/'):
+            request = {'type': 'text', 'message': text, 'client_name': self.client_name}
+            if self.room is not None:
+                request['room'] = self.room
+            return request
+
+        command, _, rest = text[1:].partition(' ')
+        rest = rest.strip()
+        if command in ('join', 'leave'):
+            if not rest:
+                raise ValueError(f"Podaj nazwę pokoju: /{command} <pokój>")
+            if command == 'join':
+                self.room = rest
+            elif self.room == rest:
+                self.room = None
+            return {'type': command, 'room': rest, 'client_name': self.client_name}
+        if command == 'msg':
+            recipient, _, message = rest.partition(' ')
+            if not recipient or not message.strip():
+                raise ValueError("Użycie: /msg <nazwa> <treść>")
+            return {'type': 'direct', 'to': recipient, 'message': message.strip(), 'client_name': self.client_name}
+        raise ValueError(f"Nieznane polecenie /{command}. {HELP}")
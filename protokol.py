@@ -0,0 +1,260 @@
+import asyncio
+import json
+import lzma
+import select
+import socket
+import struct
+import threading
+import zlib
+
+import binarny
+
+# Frame layout: version (1 byte), flags (1 byte), payload length (4 bytes, big-endian)
+PROTOCOL_VERSION = 1
+HEADER = struct.Struct('!BBI')
+HEADER_SIZE = HEADER.size
+MAX_FRAME_SIZE = 64 * 1024 * 1024
+RECV_SIZE = 65536
+
+# Flag bits
+FLAG_CHUNK = 0x01
+FLAG_ZLIB = 0x02
+FLAG_LZMA = 0x04
+FLAG_BINARY = 0x08
+
+# Codecs a connection can agree on, with the flag marking frames compressed by them
+CODECS = {'zlib': FLAG_ZLIB, 'lzma': FLAG_LZMA}
+# Message encodings a connection can agree on; JSON is always understood
+ENCODINGS = ('binary', 'json')
+
+# Raw upload chunk payload: upload id followed by file bytes
+CHUNK_HEADER = struct.Struct('!I')
+
+class ProtocolError(Exception):
+    pass
+
+def encode_frame(payload, flags=0):
+    if len(payload) > MAX_FRAME_SIZE:
+        raise ProtocolError(f"Ramka za duża: {len(payload)} bajtów")
+    return HEADER.pack(PROTOCOL_VERSION, flags, len(payload)) + payload
+
+def encode_message(message):
+    return encode_frame(json.dumps(message).encode())
+
+def encode_binary_message(message):
+    # Types and values the binary envelope (binarny) doesn't cover fall back to JSON
+    payload = binarny.encode(message)
+    if payload is None:
+        return encode_message(message)
+    return encode_frame(payload, FLAG_BINARY)
+
+def to_binary_frame(frame):
+    # Re-encodes an already built JSON frame, e.g. a broadcast, for a binary connection
+    if frame[1] != 0:
+        return frame
+    payload = binarny.encode(json.loads(bytes(memoryview(frame)[HEADER_SIZE:])))
+    if payload is None:
+        return frame
+    return encode_frame(payload, FLAG_BINARY)
+
+def encode_chunk(upload_id, data):
+    return encode_frame(CHUNK_HEADER.pack(upload_id) + data, FLAG_CHUNK)
+
+def decode_chunk(payload):
+    if len(payload) < CHUNK_HEADER.size:
+        raise ProtocolError("Za krótka ramka fragmentu pliku")
+    upload_id, = CHUNK_HEADER.unpack_from(payload)
+    return {'type': 'upload_chunk', 'upload_id': upload_id, 'data': memoryview(payload)[CHUNK_HEADER.size:]}
+
+def compress_payload(payload, codec, level):
+    if codec == 'lzma':
+        return lzma.compress(payload, preset=level)
+    return zlib.compress(payload, level)
+
+def decompress_payload(payload, flags, max_size=MAX_FRAME_SIZE):
+    # The decompressed size is capped like a frame's, so a small frame can't expand without bound
+    try:
+        if flags == FLAG_ZLIB:
+            decompressor = zlib.decompressobj()
+            data = decompressor.decompress(payload, max_size)
+            complete = decompressor.eof and not decompressor.unconsumed_tail
+        else:
+            decompressor = lzma.LZMADecompressor()
+            data = decompressor.decompress(payload, max_size)
+            complete = decompressor.eof
+    except (zlib.error, lzma.LZMAError) as e:
+        raise ProtocolError(f"Niepoprawna skompresowana ramka: {str(e)}")
+    if not complete:
+        raise ProtocolError("Skompresowana ramka jest niepełna lub za duża po rozpakowaniu")
+    return data
+
+class Compressor:
+    # Compresses outgoing message frames of at least min_size bytes and counts what it saves
+    def __init__(self, level=6, min_size=1024):
+        self.level = level
+        self.min_size = min_size
+        self.frames = 0
+        self.skipped = 0
+        self.bytes_before = 0
+        self.bytes_after = 0
+        self._lock = threading.Lock()
+
+    def compress(self, frame, codec):
+        # Only message frames; chunks and frames already compressed go out as they are
+        if len(frame) < self.min_size or frame[1] & ~FLAG_BINARY:
+            return frame
+        payload = compress_payload(memoryview(frame)[HEADER_SIZE:], codec, self.level)
+        with self._lock:
+            if HEADER_SIZE + len(payload) >= len(frame):
+                self.skipped += 1
+                return frame
+            self.frames += 1
+            self.bytes_before += len(frame)
+            self.bytes_after += HEADER_SIZE + len(payload)
+        return encode_frame(payload, CODECS[codec] | frame[1])
+
+    def stats(self):
+        with self._lock:
+            return {
+                'level': self.level,
+                'min_bytes': self.min_size,
+                'frames': self.frames,
+                'skipped': self.skipped,
+                'bytes_before': self.bytes_before,
+                'bytes_after': self.bytes_after,
+                'saved_bytes': self.bytes_before - self.bytes_after,
+                'ratio': round(self.bytes_after / self.bytes_before, 3) if self.bytes_before else None,
+            }
+
+def decode_payload(payload, flags=0):
+    if flags == FLAG_CHUNK:
+        return decode_chunk(payload)
+    compression = flags & (FLAG_ZLIB | FLAG_LZMA)
+    if compression:
+        payload = decompress_payload(payload, compression)
+        flags &= ~compression
+    if flags == FLAG_BINARY:
+        try:
+            return binarny.decode(payload)
+        except ValueError as e:
+            raise ProtocolError(f"Niepoprawna wiadomość binarna: {str(e)}")
+    if flags:
+        raise ProtocolError(f"Nieobsługiwane flagi ramki: {flags:#x}")
+    try:
+        message = json.loads(payload.decode())
+    except (UnicodeDecodeError, json.JSONDecodeError) as e:
+        raise ProtocolError(f"Niepoprawny ładunek JSON: {str(e)}")
+    if not isinstance(message, dict):
+        raise ProtocolError("Wiadomość musi być obiektem JSON")
+    return message
+
+def parse_header(header, max_frame_size=MAX_FRAME_SIZE):
+    version, flags, length = HEADER.unpack(header)
+    if version != PROTOCOL_VERSION:
+        raise ProtocolError(f"Nieobsługiwana wersja protokołu: {version}")
+    if length > max_frame_size:
+        raise ProtocolError(f"Ramka za duża: {length} bajtów")
+    return flags, length
+
+def send_message(sock, message):
+    sock.sendall(encode_message(message))
+
+class FrameDecoder:
+    def __init__(self, max_frame_size=MAX_FRAME_SIZE):
+        self.max_frame_size = max_frame_size
+        self._buffer = bytearray()
+        self._offset = 0
+
+    def feed(self, data):
+        self._buffer += data
+
+    def pending(self):
+        return len(self._buffer) - self._offset
+
+    def next_frame(self):
+        buffer = self._buffer
+        start = self._offset
+        if len(buffer) - start < HEADER_SIZE:
+            return None
+        flags, length = parse_header(buffer[start:start + HEADER_SIZE], self.max_frame_size)
+        end = start + HEADER_SIZE + length
+        if len(buffer) < end:
+            return None
+        payload = bytes(buffer[start + HEADER_SIZE:end])
+
+        # Consume lazily so back-to-back small frames don't shift the buffer each time
+        if end == len(buffer):
+            buffer.clear()
+            self._offset = 0
+        elif end > RECV_SIZE and end * 2 > len(buffer):
+            del buffer[:end]
+            self._offset = 0
+        else:
+            self._offset = end
+        return flags, payload
+
+    def next_message(self):
+        frame = self.next_frame()
+        if frame is None:
+            return None
+        flags, payload = frame
+        return decode_payload(payload, flags)
+
+def configure_keepalive(sock, idle=60, interval=10, count=5):
+    # Lets the kernel notice a peer that vanished without closing the connection;
+    # the tuning options are missing on some systems
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+    for option, value in (('TCP_KEEPIDLE', idle), ('TCP_KEEPINTVL', interval), ('TCP_KEEPCNT', count)):
+        if hasattr(socket, option):
+            try:
+                sock.setsockopt(socket.IPPROTO_TCP, getattr(socket, option), value)
+            except OSError:
+                pass
+
+class MessageReader:
+    def __init__(self, sock, recv_size=RECV_SIZE, max_frame_size=MAX_FRAME_SIZE, on_data=None):
+        self.sock = sock
+        self.recv_size = recv_size
+        self.decoder = FrameDecoder(max_frame_size)
+        self.on_data = on_data
+
+    def read_message(self, timeout=None):
+        # With a timeout every wait for data is bounded by select and raises socket.timeout,
+        # so the socket itself can stay blocking for a writer on another thread
+        while True:
+            message = self.decoder.next_message()
+            if message is not None:
+                return message
+            if timeout is not None and not select.select([self.sock], [], [], timeout)[0]:
+                raise socket.timeout("timed out")
+            data = self.sock.recv(self.recv_size)
+            if not data:
+                if self.decoder.pending():
+                    raise ProtocolError("Połączenie zamknięte w trakcie ramki")
+                return None
+            if self.on_data is not None:
+                self.on_data(len(data))
+            self.decoder.feed(data)
+
+    def __iter__(self):
+        while True:
+            message = self.read_message()
+            if message is None:
+                return
+            yield message
+
+async def read_message_async(reader, max_frame_size=MAX_FRAME_SIZE, on_data=None):
+    try:
+        header = await reader.readexactly(HEADER_SIZE)
+    except asyncio.IncompleteReadError as e:
+        if e.partial:
+            raise ProtocolError("Połączenie zamknięte w trakcie ramki")
+        return None
+    flags, length = parse_header(header, max_frame_size)
+    try:
+        payload = await reader.readexactly(length)
+    except asyncio.IncompleteReadError:
+        raise ProtocolError("Połączenie zamknięte w trakcie ramki")
+    if on_data is not None:
+        on_data(HEADER_SIZE + length)
+    return decode_payload(payload, flags)
@@ -0,0 +1,100 @@
+import hashlib
+import itertools
+import os
+
+from protokol import encode_chunk, encode_message
+
+CHUNK_SIZE = 64 * 1024
+MAX_UPLOAD_SIZE = 1024 * 1024 * 1024
+
+class UploadError(Exception):
+    pass
+
+class UploadCancelled(UploadError):
+    pass
+
+class Upload:
+    def __init__(self, upload_id, file_name, size, temp_path, writer):
+        # Without temp_path the content is already stored; chunks are only hashed.
+        # Otherwise they are handed to the background writer (zapis_w_tle.DiskWriter)
+        self.upload_id = upload_id
+        self.file_name = file_name
+        self.size = size
+        self.temp_path = temp_path
+        self.writer = writer
+        self.received = 0
+        self._sha256 = hashlib.sha256()
+
+    def write(self, data):
+        if self.received + len(data) > self.size:
+            raise UploadError(f"Plik {self.file_name} jest większy niż zapowiedziano ({self.size} bajtów)")
+        if self.temp_path:
+            self.writer.append(self.temp_path, data)
+        self._sha256.update(data)
+        self.received += len(data)
+
+    def finish(self, sha256):
+        if self.received != self.size:
+            raise UploadError(f"Odebrano {self.received} z {self.size} bajtów pliku {self.file_name}")
+        digest = self._sha256.hexdigest()
+        if digest != sha256:
+            raise UploadError(f"Niezgodna suma kontrolna pliku {self.file_name}")
+        return digest
+
+    def abort(self):
+        if self.temp_path:
+            self.writer.discard(self.temp_path)
+
+def file_sha256(file_path, chunk_size=CHUNK_SIZE):
+    sha256 = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        while True:
+            data = f.read(chunk_size)
+            if not data:
+                break
+            sha256.update(data)
+    return sha256.hexdigest()
+
+_upload_ids = itertools.count(1)
+
+def upload_file(send, file_path, client_name, chunk_size=CHUNK_SIZE, progress=None, cancelled=None, room=None):
+    # send receives ready-to-write frames; memory use is one chunk regardless of file size.
+    # progress(sent, size) is called after each chunk; once cancelled() returns true the
+    # server is told to drop the partial file and UploadCancelled is raised
+    upload_id = next(_upload_ids)
+    size = os.path.getsize(file_path)
+    # Announcing the hash up front lets the server skip writing content it already has
+    sha256 = file_sha256(file_path, chunk_size)
+
+    send(encode_message({
+        'type': 'upload_start',
+        'upload_id': upload_id,
+        'file_name': os.path.basename(file_path),
+        'size': size,
+        'sha256': sha256,
+        'client_name': client_name
+    }))
+    sent = 0
+    with open(file_path, 'rb') as f:
+        while True:
+            if cancelled is not None and cancelled():
+                send(encode_message({'type': 'upload_cancel', 'upload_id': upload_id, 'client_name': client_name}))
+                raise UploadCancelled(f"Anulowano przesyłanie pliku {os.path.basename(file_path)}")
+            data = f.read(chunk_size)
+            if not data:
+                break
+            send(encode_chunk(upload_id, data))
+            sent += len(data)
+            if progress is not None:
+                progress(sent, size)
+    end = {
+        'type': 'upload_end',
+        'upload_id': upload_id,
+        'sha256': sha256,
+        'client_name': client_name
+    }
+    if room is not None:
+        # The room that is told about the document
+        end['room'] = room
+    send(encode_message(end))
+    return upload_id
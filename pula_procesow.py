@@ -0,0 +1,112 @@
+import multiprocessing
+import os
+import signal
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+class ConversionError(Exception):
+    pass
+
+class PoolBusyError(ConversionError):
+    pass
+
+class ConversionTimeout(ConversionError):
+    pass
+
+def _ignore_sigint():
+    # Ctrl+C is handled by the server process, which then shuts the pool down; the
+    # server's SIGTERM handler is inherited on fork, so workers get the default back
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+
+class ConversionPool:
+    def __init__(self, processes=None, max_pending=None, timeout=30.0):
+        self.processes = processes or os.cpu_count() or 1
+        self.max_pending = max_pending or self.processes * 4
+        self.timeout = timeout
+        self.submitted = 0
+        self.completed = 0
+        self.rejected = 0
+        self.timeouts = 0
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+        self._lock = threading.Lock()
+        self._executor = self._create_executor()
+
+    def _create_executor(self):
+        # The server already runs writer, logging and bus threads when the pool
+        # starts its workers, so they must not be forked from it
+        method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+        return ProcessPoolExecutor(max_workers=self.processes, mp_context=multiprocessing.get_context(method),
+                                   initializer=_ignore_sigint)
+
+    def run(self, func, *args, timeout=None, on_done=None):
+        # Reject instead of queueing without bound; the slot is freed only when
+        # the job really finishes, so timed-out jobs still count against the limit.
+        # on_done is called once at that point too, or at once if the job never started
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.rejected += 1
+            if on_done is not None:
+                on_done()
+            raise PoolBusyError("Wszystkie procesy konwersji są zajęte, spróbuj ponownie później")
+
+        executor = self._executor
+        try:
+            future = executor.submit(func, *args)
+        except BaseException as e:
+            self._slots.release()
+            if on_done is not None:
+                on_done()
+            if isinstance(e, BrokenProcessPool):
+                self._restart(executor)
+                raise ConversionError("Proces konwersji uległ awarii")
+            raise
+        with self._lock:
+            self.submitted += 1
+        future.add_done_callback(lambda f: self._job_done(on_done))
+
+        try:
+            return future.result(timeout=timeout if timeout is not None else self.timeout)
+        except TimeoutError:
+            # cancel() cannot stop a job that is already running, so the workers are
+            # killed; jobs running next to it fail with BrokenProcessPool
+            with self._lock:
+                self.timeouts += 1
+            self._restart(executor, kill=True)
+            raise ConversionTimeout("Przekroczono czas konwersji")
+        except BrokenProcessPool:
+            self._restart(executor)
+            raise ConversionError("Proces konwersji uległ awarii")
+
+    def _job_done(self, on_done):
+        self._slots.release()
+        with self._lock:
+            self.completed += 1
+        if on_done is not None:
+            on_done()
+
+    def _restart(self, broken, kill=False):
+        # Jobs failing together on one broken executor must replace it only once
+        with self._lock:
+            if self._executor is not broken:
+                return
+            self._executor = self._create_executor()
+        if kill:
+            for process in list(broken._processes.values()):
+                process.kill()
+        broken.shutdown(wait=False, cancel_futures=True)
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait, cancel_futures=True)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'processes': self.processes,
+                'max_pending': self.max_pending,
+                'submitted': self.submitted,
+                'completed': self.completed,
+                'rejected': self.rejected,
+                'timeouts': self.timeouts,
+            }
@@ -0,0 +1,227 @@
+import threading
+from collections import deque
+
+from protokol import encode_message
+
+POLICIES = ('drop', 'coalesce', 'disconnect')
+MAX_BATCH_BYTES = 256 * 1024
+
+class OutboundQueue:
+    def __init__(self, max_messages=1000, policy='coalesce', on_ready=None):
+        if policy not in POLICIES:
+            raise ValueError(f"Nieznana polityka wolnego odbiorcy: {policy}")
+        self.max_messages = max_messages
+        self.policy = policy
+        self.on_ready = on_ready
+        self.closed = False
+        self.dropped = 0
+        self.high_watermark = 0
+        self._skipped = 0
+        self._items = deque()
+        self._cond = threading.Condition()
+
+    def put(self, data, wait=True):
+        # Replies to the client's own requests are never dropped; waiting here
+        # only slows down that client's handler
+        with self._cond:
+            while wait and not self.closed and len(self._items) >= self.max_messages:
+                self._cond.wait()
+            if self.closed:
+                raise ConnectionError("Kolejka wychodząca jest zamknięta")
+            self._append(data, False)
+
+    def offer(self, data):
+        # Broadcasts must never block the sender; returns False when the
+        # client should be disconnected
+        with self._cond:
+            if self.closed:
+                return False
+            if len(self._items) >= self.max_messages:
+                if self.policy == 'disconnect':
+                    return False
+                if self.policy == 'coalesce' and self._drop_oldest_broadcast():
+                    self._skipped += 1
+                else:
+                    self.dropped += 1
+                    return True
+            self._append(data, True)
+            return True
+
+    def _append(self, data, droppable):
+        self._items.append((data, droppable))
+        self.high_watermark = max(self.high_watermark, len(self._items))
+        self._cond.notify_all()
+        if self.on_ready is not None:
+            self.on_ready()
+
+    def _drop_oldest_broadcast(self):
+        for index, (_, droppable) in enumerate(self._items):
+            if droppable:
+                del self._items[index]
+                return True
+        return False
+
+    def _take_batch(self, max_bytes):
+        batch = []
+        if self._skipped:
+            batch.append(encode_message({
+                'type': 'text',
+                'message': f"Pominięto {self._skipped} wiadomości z powodu zbyt wolnego połączenia."
+            }))
+            self.dropped += self._skipped
+            self._skipped = 0
+        size = 0
+        while self._items and (not batch or size < max_bytes):
+            data, _ = self._items.popleft()
+            batch.append(data)
+            size += len(data)
+        self._cond.notify_all()
+        return batch
+
+    def get_batch(self, max_bytes=MAX_BATCH_BYTES, timeout=None):
+        # Returns None once the queue is closed and everything queued was handed out
+        with self._cond:
+            while not self._items and not self.closed:
+                if not self._cond.wait(timeout):
+                    return []
+            if not self._items:
+                return None
+            return self._take_batch(max_bytes)
+
+    def get_batch_nowait(self, max_bytes=MAX_BATCH_BYTES):
+        with self._cond:
+            if not self._items:
+                return None if self.closed else []
+            return self._take_batch(max_bytes)
+
+    def close(self, discard=False):
+        with self._cond:
+            self.closed = True
+            if discard:
+                self._items.clear()
+            self._cond.notify_all()
+        if self.on_ready is not None:
+            self.on_ready()
+
+    def __len__(self):
+        return len(self._items)
+
+    def stats(self):
+        with self._cond:
+            return {
+                'depth': len(self._items),
+                'high_watermark': self.high_watermark,
+                'dropped': self.dropped + self._skipped,
+            }
+
+class ClientRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        # Replaced, never mutated, so broadcast can iterate without holding the lock
+        self._clients = ()
+        # Room -> tuple of subscribers, replaced the same way
+        self._rooms = {}
+        self._memberships = {}
+        self._names = {}
+        # Called as on_name(name) after a name got or lost its owner; find() gives the outcome
+        self.on_name = None
+
+    def _name_changed(self, name):
+        if self.on_name is not None:
+            self.on_name(name)
+
+    def add(self, client):
+        with self._lock:
+            self._clients = self._clients + (client,)
+            self._memberships[client] = set()
+            owned = self._names.setdefault(client.name, client) is client
+        if owned:
+            self._name_changed(client.name)
+
+    def remove(self, client):
+        with self._lock:
+            if client not in self._clients:
+                return False
+            self._clients = tuple(c for c in self._clients if c is not client)
+            for room in self._memberships.pop(client, ()):
+                self._leave(client, room)
+            owned = self._names.get(client.name) is client
+            if owned:
+                del self._names[client.name]
+        if owned:
+            self._name_changed(client.name)
+        return True
+
+    def join(self, client, room):
+        with self._lock:
+            rooms = self._memberships.get(client)
+            if rooms is None or room in rooms:
+                return False
+            rooms.add(room)
+            self._rooms[room] = self._rooms.get(room, ()) + (client,)
+            return True
+
+    def leave(self, client, room):
+        with self._lock:
+            rooms = self._memberships.get(client)
+            if rooms is None or room not in rooms:
+                return False
+            rooms.discard(room)
+            self._leave(client, room)
+            return True
+
+    def _leave(self, client, room):
+        members = tuple(c for c in self._rooms.get(room, ()) if c is not client)
+        if members:
+            self._rooms[room] = members
+        else:
+            self._rooms.pop(room, None)
+
+    def members(self, room):
+        return self._rooms.get(room, ())
+
+    def is_member(self, client, room):
+        return room in self._memberships.get(client, ())
+
+    def rooms_of(self, client):
+        with self._lock:
+            return sorted(self._memberships.get(client, ()))
+
+    def claim_name(self, client, name):
+        # A name belongs to the first connected client using it, until it disconnects
+        with self._lock:
+            owner = self._names.get(name)
+            if owner is not None and owner is not client:
+                return False
+            previous = client.name if self._names.get(client.name) is client else None
+            if previous is not None:
+                del self._names[previous]
+            self._names[name] = client
+            client.name = name
+        if previous is not None:
+            self._name_changed(previous)
+        self._name_changed(name)
+        return True
+
+    def find(self, name):
+        return self._names.get(name)
+
+    def names(self):
+        with self._lock:
+            return list(self._names)
+
+    def stats(self):
+        with self._lock:
+            return {'rooms': len(self._rooms), 'named_clients': len(self._names)}
+
+    def snapshot(self):
+        return self._clients
+
+    def __iter__(self):
+        return iter(self._clients)
+
+    def __len__(self):
+        return len(self._clients)
+
+    def __contains__(self, client):
+        return client in self._clients
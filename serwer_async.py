@@ -0,0 +1,192 @@
+import asyncio
+import signal
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import serwer_w
+from dziennik import log
+from protokol import ProtocolError, read_message_async
+
+# Request types cheap enough to handle directly on the event loop
+INLINE_TYPES = {'text', 'ping', 'pong', 'compression', 'encoding'}
+
+class AsyncClient(serwer_w.Client):
+    def __init__(self, reader, writer, loop, name=None):
+        super().__init__(writer.get_extra_info('socket'), writer.get_extra_info('peername'), name)
+        self.reader = reader
+        self.writer = writer
+        self.loop = loop
+        self.loop_thread = threading.get_ident()
+        self.busy = False
+        self.writer_task = None
+        self._ready = asyncio.Event()
+
+    def _in_loop(self):
+        return threading.get_ident() == self.loop_thread
+
+    def _outbound_ready(self):
+        # handle_request and broadcast may run in executor threads; the event belongs to the loop
+        if self._in_loop():
+            self._ready.set()
+        else:
+            self.loop.call_soon_threadsafe(self._ready.set)
+
+    def start_writer(self):
+        self.writer_task = self.loop.create_task(self._write_loop())
+
+    async def _write_loop(self):
+        try:
+            while True:
+                self._ready.clear()
+                batch = self.outbound.get_batch_nowait()
+                if batch is None:
+                    break
+                if not batch:
+                    await self._ready.wait()
+                    continue
+                data = b''.join(batch)
+                self.write_started = time.monotonic()
+                self.writer.write(data)
+                await self.writer.drain()
+                self.write_started = None
+                serwer_w.metrics.add_bytes_out(len(data))
+        except (ConnectionError, OSError):
+            self.disconnect()
+
+    def send(self, data):
+        # Blocking for room is fine in an executor thread, never on the loop
+        self.outbound.put(self.prepare(data), wait=not self._in_loop())
+
+    def disconnect(self):
+        self.outbound.close(discard=True)
+        if self._in_loop():
+            self.writer.close()
+        else:
+            self.loop.call_soon_threadsafe(self.writer.close)
+
+    async def aclose(self, timeout=5.0):
+        self.outbound.close()
+        try:
+            await asyncio.wait_for(self.writer_task, timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError):
+            pass
+        self.writer.close()
+        try:
+            await self.writer.wait_closed()
+        except Exception:
+            pass
+
+class AsyncServer:
+    def __init__(self, host, port, backlog=1024, workers=None, shutdown_timeout=30.0, reuse_port=False, unix_server=None):
+        self.host = host
+        self.port = port
+        self.backlog = backlog
+        self.reuse_port = reuse_port
+        self.shutdown_timeout = shutdown_timeout
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='konwersja')
+        self.connections = {}
+        self.closing = False
+        self.server = None
+        # Already listening socket from serwer_w.open_unix_socket, served next to TCP
+        self.unix_socket = unix_server
+        self.unix_server = None
+
+    async def start(self):
+        self.server = await asyncio.start_server(
+            self.handle_connection, self.host, self.port, backlog=self.backlog, reuse_port=self.reuse_port or None)
+        log.info("Serwer (asyncio) nasłuchuje na %s:%d", self.host, self.port)
+        if self.unix_socket is not None:
+            self.unix_server = await asyncio.start_unix_server(
+                lambda reader, writer: self.handle_connection(reader, writer, unix=True), sock=self.unix_socket)
+            log.info("Serwer (asyncio) nasłuchuje też na gnieździe %s", self.unix_socket.getsockname())
+
+    async def handle_connection(self, reader, writer, unix=False):
+        loop = asyncio.get_running_loop()
+        client = AsyncClient(reader, writer, loop, serwer_w.unix_client_name() if unix else None)
+        self.connections[asyncio.current_task()] = client
+        client.start_writer()
+        serwer_w.register_client(client)
+        log.info("Połączono z %s (%s)", client.name, client.address or "gniazdo Unix")
+
+        try:
+            while not self.closing:
+                request = await read_message_async(reader, on_data=client.received)
+                if request is None:
+                    break
+
+                client.busy = True
+                try:
+                    if request.get('type') in INLINE_TYPES:
+                        serwer_w.handle_request(client, request)
+                    else:
+                        await loop.run_in_executor(self.executor, serwer_w.handle_request, client, request)
+                except ProtocolError as e:
+                    log.warning("Błędna wiadomość od %s: %s", client.name, e)
+                client.busy = False
+        except ProtocolError as e:
+            log.warning("Błąd protokołu klienta %s: %s", client.name, e)
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            log.error("Błąd obsługi klienta %s: %s", client.name, e)
+        finally:
+            del self.connections[asyncio.current_task()]
+            serwer_w.abort_uploads(client)
+            serwer_w.remove_client(client)
+            await client.aclose()
+
+    async def shutdown(self):
+        self.closing = True
+        self.server.close()
+        if self.unix_server is not None:
+            self.unix_server.close()
+
+        # Idle connections are waiting for the next frame and can go right away;
+        # those in the middle of a request get shutdown_timeout to finish it
+        busy = 0
+        for task, client in list(self.connections.items()):
+            if client.busy:
+                busy += 1
+            else:
+                task.cancel()
+        pending = list(self.connections)
+        if pending:
+            if busy:
+                log.info("Oczekiwanie na zakończenie %d żądań w toku...", busy)
+            done, pending = await asyncio.wait(pending, timeout=self.shutdown_timeout)
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+
+        await self.server.wait_closed()
+        if self.unix_server is not None:
+            await self.unix_server.wait_closed()
+        self.executor.shutdown(wait=True)
+        log.info("Serwer zatrzymany.")
+
+    async def serve(self):
+        await self.start()
+        loop = asyncio.get_running_loop()
+        stop = asyncio.Event()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, stop.set)
+            except (NotImplementedError, AttributeError, ValueError):
+                pass
+        try:
+            await stop.wait()
+        finally:
+            await self.shutdown()
+
+def main(args, reuse_port=False, unix_server=None):
+    backlog = args.backlog if args.backlog is not None else 1024
+    server = AsyncServer(args.host, args.port, backlog, args.workers, args.shutdown_timeout, reuse_port, unix_server)
+    try:
+        asyncio.run(server.serve())
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    serwer_w.main(['--async'] + sys.argv[1:])
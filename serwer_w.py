@@ -1,68 +1,462 @@
+import argparse
+import multiprocessing
+import shutil
+import signal
 import socket
+import stat
+import tempfile
 import threading
 from PIL import Image
-import json
 import base64
 import io
 import os
 import datetime
+import hashlib
+import itertools
+import logging
+import time
 from docx import Document
+from docx_tekst import extract_docx_text_fast
+from obrazy import MAX_ASCII_HEIGHT, ascii_grid_size, ascii_pixels
+from protokol import (CODECS, ENCODINGS, Compressor, MessageReader, ProtocolError, configure_keepalive,
+                      encode_binary_message, encode_message, to_binary_frame)
+from pamiec_podreczna import LRUCache
+from pula_procesow import ConversionError, ConversionPool, PoolBusyError
+from przesylanie import MAX_UPLOAD_SIZE, Upload, UploadError
+from rozglaszanie import POLICIES, ClientRegistry, OutboundQueue
+from metryki import Metrics, start_http_endpoint
+from magistrala import BusClient, BusHub, RemoteNames
+from magazyn import BlobStore
+from historia import MessageLog
+from limity import ConcurrencyLimit, RateLimits, ServerBusy
+import dziennik
+from dziennik import LEVELS, fields, log, truncate
+from zapis_w_tle import DURABILITY_POLICIES, DiskWriter, WriteError
+
+# Configured by main()
+OUTBOUND_QUEUE_SIZE = 1000
+SLOW_CONSUMER_POLICY = 'coalesce'
 
 class Client:
     def __init__(self, socket, address, name=None):
         self.socket = socket
         self.address = address
         self.name = name or f"Klient_{address[1]}"
+        self.uploads = {}
+        self.failed_uploads = set()
+        # Token buckets for the rate-limited request types, filled in by rate_limits
+        self.rate_buckets = {}
+        # Agreed on with 'encoding' and 'compression' requests; frames are built as JSON
+        # and converted for the connection by prepare()
+        self.encoding = 'json'
+        self.compression = None
+        self.outbound = OutboundQueue(OUTBOUND_QUEUE_SIZE, SLOW_CONSUMER_POLICY, self._outbound_ready)
+        self.writer_thread = None
+        # Watched by reap_clients: when the client last sent anything, when it was
+        # last pinged and since when a write to it has been in progress
+        self.last_seen = time.monotonic()
+        self.last_ping = 0.0
+        self.write_started = None
+
+    def received(self, count):
+        self.last_seen = time.monotonic()
+        metrics.add_bytes_in(count)
+
+    def _outbound_ready(self):
+        pass
+
+    def start_writer(self):
+        self.writer_thread = threading.Thread(target=self._write_loop, daemon=True)
+        self.writer_thread.start()
+
+    def _write_loop(self):
+        # The only place that writes to the socket, so frames never interleave
+        try:
+            while True:
+                batch = self.outbound.get_batch()
+                if batch is None:
+                    break
+                data = b''.join(batch)
+                self.write_started = time.monotonic()
+                self.socket.sendall(data)
+                self.write_started = None
+                metrics.add_bytes_out(len(data))
+        except OSError:
+            self.disconnect()
+
+    def prepare(self, data, shared=None, message=None):
+        # shared lets a broadcast convert its frame once per variant instead of once per recipient;
+        # message is the dict data was encoded from, if the caller still has it
+        variant = (self.encoding, self.compression)
+        if variant == ('json', None):
+            return data
+        frame = shared.get(variant) if shared is not None else None
+        if frame is None:
+            if self.encoding != 'binary':
+                frame = data
+            elif message is not None:
+                frame = encode_binary_message(message)
+            else:
+                frame = to_binary_frame(data)
+            if self.compression is not None:
+                frame = compressor.compress(frame, self.compression)
+            if shared is not None:
+                shared[variant] = frame
+        return frame
+
+    def send(self, data):
+        self.outbound.put(self.prepare(data))
+
+    def send_message(self, message):
+        # Replies built for this client alone are encoded for it directly, without the JSON step
+        if self.encoding == 'binary':
+            frame = encode_binary_message(message)
+            self.send(frame if self.compression is None else compressor.compress(frame, self.compression))
+        else:
+            self.send(encode_message(message))
+
+    def offer(self, data, shared=None, message=None):
+        if not self.outbound.offer(self.prepare(data, shared, message)):
+            log.warning("Klient %s nie nadąża z odbiorem, rozłączanie.", self.name)
+            self.disconnect()
+
+    def disconnect(self):
+        self.outbound.close(discard=True)
+        try:
+            self.socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    def close(self, timeout=5.0):
+        # Let the writer flush what is already queued before the socket goes away
+        self.outbound.close()
+        if self.writer_thread is not None and self.writer_thread is not threading.current_thread():
+            self.writer_thread.join(timeout)
+        self.socket.close()
+
+clients = ClientRegistry()
+
+REQUEST_TYPES = ('text', 'image_to_ascii', 'docx_file', 'upload_start', 'upload_chunk', 'upload_end', 'upload_cancel',
+                 'stats', 'document_get', 'history', 'join', 'leave', 'direct', 'ping', 'pong', 'compression', 'encoding')
+metrics = Metrics(REQUEST_TYPES)
+
+ascii_cache = LRUCache(max_entries=256, max_bytes=16 * 1024 * 1024)
 
-clients = []
+# Set up by main(); without it conversions run on the calling thread
+conversion_pool = None
+
+# Per-client limits for expensive requests: type -> (requests per minute, burst)
+DEFAULT_RATE_LIMITS = {
+    'image_to_ascii': (60, 10),
+    'docx_file': (20, 5),
+    'upload_start': (20, 5),
+    'document_get': (120, 20),
+    'history': (30, 5),
+}
+CONVERSION_RETRY_AFTER = 1.0
+# Conversion time grows with the square of the width, so it is checked before a job is submitted
+MAX_ASCII_WIDTH = 200
+# Configured by main()
+rate_limits = RateLimits({})
+conversion_slots = None
+
+PREVIEW_LENGTH = 200
+DOCUMENT_PAGE_SIZE = 16000
+MAX_DOCUMENT_PAGE_SIZE = 256000
 
 DOCX_FOLDER = "odebrane_pliki"
 if not os.path.exists(DOCX_FOLDER):
     os.makedirs(DOCX_FOLDER)
 
-def broadcast(message, sender=None):
-    for client in clients:
-        if client != sender:
-            try:
-                client.socket.send(message)
-            except:
-                remove_client(client)
+blob_store = BlobStore(os.path.join(DOCX_FOLDER, '.blobs'))
+
+# Configured by main()
+ACK_POLICY = 'received'
+WRITE_TIMEOUT = 60.0
+disk_writer = None
+
+# Set up by main() when several server processes share the port
+bus = None
+instance_index = 0
+# Bus topics that keep remote_names up to date; rooms can't start with '!'
+NAME_CHANGED = '!name'
+NAMES_REQUEST = '!names'
+remote_names = RemoteNames()
+_name_announcements = threading.Lock()
+
+HISTORY_FOLDER = "historia"
+DEFAULT_HISTORY = 50
+MAX_HISTORY = 1000
+# Set up by main(); every broadcast is appended to it
+message_log = None
+
+DEFAULT_ROOM = 'ogólny'
+MAX_ROOM_NAME = 64
+
+def broadcast(message, sender=None, room=DEFAULT_ROOM):
+    frame = encode_message(message)
+    deliver_broadcast(room, frame, sender, message)
+    if bus is not None:
+        # Clients of the other server processes get the same JSON frame over the bus
+        bus.publish(frame, room)
+
+def deliver_broadcast(room, frame, sender=None, message=None):
+    # Each encoding and compression variant is built once and the same bytes are queued
+    # for every subscriber using it; frames from the bus come without the message dict
+    start = time.perf_counter()
+    if message_log is not None and room == DEFAULT_ROOM:
+        # Only the room everyone starts in is kept; other rooms stay with their members
+        message_log.append(frame)
+    recipients = 0
+    variants = {}
+    for client in clients.members(room):
+        if client is not sender:
+            client.offer(frame, variants, message)
+            recipients += 1
+    metrics.observe_broadcast(time.perf_counter() - start, recipients)
+
+def deliver_direct(name, message):
+    recipient = clients.find(name)
+    if recipient is None:
+        return False
+    recipient.offer(message)
+    return True
+
+def deliver_bus_message(topic, message):
+    # Direct messages travel as '@name', name announcements as '!...', everything else is a room
+    if topic.startswith('@'):
+        deliver_direct(topic[1:], message)
+    elif topic == NAME_CHANGED:
+        origin, claimed, name = message.decode('utf-8').split(':', 2)
+        remote_names.update(int(origin), name, claimed == '1')
+    elif topic == NAMES_REQUEST:
+        # Publishing from the bus thread could block it, so the answer goes from its own thread
+        threading.Thread(target=announce_names, daemon=True).start()
+    else:
+        deliver_broadcast(topic, message)
+
+def announce_name(name):
+    # Publishes who owns the name now rather than what changed, under one lock, so two
+    # changes racing each other still leave the other processes with the final state
+    with _name_announcements:
+        claimed = clients.find(name) is not None
+        try:
+            bus.publish(f"{instance_index}:{int(claimed)}:{name}".encode('utf-8'), NAME_CHANGED)
+        except OSError:
+            # The bus is already closed while the server shuts down
+            pass
+
+def announce_names():
+    for name in clients.names():
+        announce_name(name)
+
+def room_name(value):
+    if not isinstance(value, str):
+        return None
+    value = value.strip()
+    if not 0 < len(value) <= MAX_ROOM_NAME or value[0] in '@!':
+        return None
+    return value
+
+def target_room(client, request):
+    # Messages go to the requested room only when the client is subscribed to it
+    room = room_name(request.get('room', DEFAULT_ROOM))
+    if room is None or not clients.is_member(client, room):
+        return None
+    return room
+
+def upload_room(client, request):
+    # Documents without a room are announced in the default one; a named room must be joined
+    if 'room' not in request:
+        return DEFAULT_ROOM
+    return target_room(client, request)
+
+def send_room_error(client, request):
+    client.send(encode_message({'type': 'room', 'room': request.get('room'),
+                                'error': f"Nie należysz do pokoju {request.get('room')}."}))
+
+def run_conversion(func, *args, wait=True):
+    # Without wait a conversion over the limit is refused with ServerBusy instead of queueing
+    if conversion_slots is not None and not conversion_slots.acquire(wait):
+        raise ServerBusy("Serwer wykonuje za dużo konwersji naraz, spróbuj ponownie później", CONVERSION_RETRY_AFTER)
+    release = conversion_slots.release if conversion_slots is not None else None
+    if conversion_pool is None:
+        try:
+            return func(*args)
+        finally:
+            if release is not None:
+                release()
+    # The pool frees the slot once the job has really ended, not when a timeout gives up on it
+    try:
+        return conversion_pool.run(func, *args, on_done=release)
+    except PoolBusyError as e:
+        if wait:
+            raise
+        raise ServerBusy(str(e), CONVERSION_RETRY_AFTER)
+
+# Optional features clients may rely on; sent in the welcome message on connect,
+# together with 'history' when the message log is turned on
+CAPABILITIES = ('image_prescaled', 'rooms')
+
+# Configured by main(); codecs offered to clients in order of preference, empty to turn compression off
+COMPRESSION_CODECS = ('zlib',)
+# Configured by main(); message encodings offered to clients besides JSON
+MESSAGE_ENCODINGS = ('binary',)
+compressor = Compressor()
+
+def send_welcome(client):
+    capabilities = list(CAPABILITIES)
+    if message_log is not None:
+        capabilities.append('history')
+    welcome = {'type': 'welcome', 'name': client.name, 'room': DEFAULT_ROOM, 'capabilities': capabilities}
+    if COMPRESSION_CODECS:
+        welcome['capabilities'].append('compression')
+        welcome['compression'] = list(COMPRESSION_CODECS)
+    if MESSAGE_ENCODINGS:
+        welcome['capabilities'].append('binary')
+        welcome['encodings'] = list(MESSAGE_ENCODINGS) + ['json']
+    client.send(encode_message(welcome))
+
+def set_encoding(client, request):
+    encoding = request.get('encoding')
+    if encoding != 'json' and encoding not in MESSAGE_ENCODINGS:
+        client.send(encode_message({'type': 'encoding', 'encoding': client.encoding,
+                                    'error': f"Serwer nie obsługuje kodowania {encoding}."}))
+        return
+    # The client keeps accepting both, so frames already queued as JSON are fine
+    client.encoding = encoding
+    client.send(encode_message({'type': 'encoding', 'encoding': encoding}))
+
+def set_compression(client, request):
+    codec = request.get('codec')
+    if codec is not None and codec not in COMPRESSION_CODECS:
+        client.send(encode_message({'type': 'compression', 'codec': client.compression,
+                                    'error': f"Serwer nie obsługuje kompresji {codec}."}))
+        return
+    # Frames queued before this point are already encoded and go out uncompressed
+    client.compression = codec
+    client.send(encode_message({'type': 'compression', 'codec': codec}))
+
+def register_client(client):
+    if TCP_KEEPALIVE and client.socket.family != socket.AF_UNIX:
+        configure_keepalive(client.socket, TCP_KEEPALIVE)
+    clients.add(client)
+    clients.join(client, DEFAULT_ROOM)
+    metrics.connection_opened()
+    send_welcome(client)
+
+# Configured by main(); 0 turns the warning off
+SLOW_REQUEST = 1.0
+
+# Configured by main(); 0 turns the feature off
+HEARTBEAT_INTERVAL = 30.0
+IDLE_TIMEOUT = 90.0
+SEND_TIMEOUT = 30.0
+TCP_KEEPALIVE = 60
+reaper_stats = {'pings': 0, 'idle': 0, 'stalled': 0}
+
+def reap_clients():
+    # Pings clients that have gone quiet and disconnects those that stopped answering
+    # or stopped reading; the connection's own handler then frees everything
+    ping = encode_message({'type': 'ping'})
+    while True:
+        time.sleep(max(0.5, HEARTBEAT_INTERVAL / 4))
+        now = time.monotonic()
+        for client in clients.snapshot():
+            write_started = client.write_started
+            if SEND_TIMEOUT and write_started is not None and now - write_started > SEND_TIMEOUT:
+                log.warning("Klient %s nie odbiera danych od %.0f s, rozłączanie.", client.name, now - write_started)
+                reaper_stats['stalled'] += 1
+                client.disconnect()
+            elif IDLE_TIMEOUT and now - client.last_seen > IDLE_TIMEOUT:
+                log.warning("Klient %s nie odpowiada od %.0f s, rozłączanie.", client.name, now - client.last_seen)
+                reaper_stats['idle'] += 1
+                client.disconnect()
+            elif now - client.last_seen > HEARTBEAT_INTERVAL and now - client.last_ping > HEARTBEAT_INTERVAL:
+                client.last_ping = now
+                reaper_stats['pings'] += 1
+                client.offer(ping)
+
+# How often the message log drops messages past --history-days
+HISTORY_EXPIRE_INTERVAL = 60.0
+
+def expire_history():
+    while True:
+        time.sleep(HISTORY_EXPIRE_INTERVAL)
+        try:
+            message_log.expire()
+        except OSError as e:
+            log.warning("Nie udało się usunąć starej historii: %s", e)
 
 def remove_client(client):
-    if client in clients:
-        clients.remove(client)
-        print(f"Klient {client.name} rozłączony.")
+    if clients.remove(client):
+        log.info("Klient %s rozłączony.", client.name)
+
+ASCII_CHARS = '@%#*+=-:. '
+# Precomputed with the same expression the per-pixel loop used, so output is byte-identical
+ASCII_TABLE = bytes(ord(ASCII_CHARS[int(value * (len(ASCII_CHARS) - 1) / 255)]) for value in range(256))
+
+def render_ascii(pixels, width, height):
+    if not width or not height:
+        return ""
+    mapped = pixels.translate(ASCII_TABLE)
+    rows = [mapped[offset:offset + width] for offset in range(0, width * height, width)]
+    rows.append(b"")
+    return b"\n".join(rows).decode('ascii')
 
-def image_to_ascii(image_data, width):
+def convert_image_to_ascii(image_bytes, width, prescaled=False):
+    image = Image.open(io.BytesIO(image_bytes))
+    
+    if prescaled:
+        # The client already reduced the image to the character grid (obrazy.prescale_image)
+        width, height = image.size
+    else:
+        width, height = ascii_grid_size(image.size, width)
+    
+    image = ascii_pixels(image, width, height)
+    
+    return render_ascii(image.tobytes(), width, height)
+
+def check_prescaled(image_bytes, width):
+    # A prescaled image is rendered at its own size, so that size is what the limits apply to;
+    # only the header is read here, the pixels are decoded by the conversion itself
+    with Image.open(io.BytesIO(image_bytes)) as image:
+        image_width, image_height = image.size
+    if image_width != width or image_height > MAX_ASCII_HEIGHT:
+        raise ValueError(f"pomniejszony obraz {image_width}×{image_height} nie pasuje do szerokości {width} "
+                         f"(maks. wysokość {MAX_ASCII_HEIGHT})")
+
+def image_to_ascii(image_data, width, prescaled=False):
     try:
-        image_bytes = base64.b64decode(image_data)
-        image = Image.open(io.BytesIO(image_bytes))
-        
-        orig_width, orig_height = image.size
-        aspect_ratio = orig_height / orig_width
-        height = int(aspect_ratio * width * 0.5)
-        
-        image = image.resize((width, height))
-        image = image.convert('L')
+        # Binary messages carry the image as raw bytes, JSON ones as base64
+        image_bytes = image_data if isinstance(image_data, bytes) else base64.b64decode(image_data)
         
-        chars = '@%#*+=-:. '
+        # Clients keep sending the same few images; skip the PIL decode for repeats
+        key = (hashlib.sha256(image_bytes).digest(), width, prescaled)
+        ascii_art = ascii_cache.get(key)
+        if ascii_art is None:
+            if prescaled:
+                check_prescaled(image_bytes, width)
+            ascii_art = run_conversion(convert_image_to_ascii, image_bytes, width, prescaled, wait=False)
+            ascii_cache.put(key, ascii_art)
         
-        ascii_str = ""
-        for y in range(height):
-            for x in range(width):
-                pixel_value = image.getpixel((x, y))
-                char_idx = int(pixel_value * (len(chars)-1) / 255)
-                ascii_str += chars[char_idx]
-            ascii_str += "\n"
-        
-        return ascii_str
+        return ascii_art
+    except ServerBusy:
+        raise
     except Exception as e:
         return f"Błąd konwersji: {str(e)}"
 
-def extract_docx_text(file_bytes):
+def extract_docx_text(source):
+    # Streamed uploads pass a path so the file never has to be held in memory
+    try:
+        return extract_docx_text_fast(source)
+    except Exception:
+        # Fall back to the full python-docx object model for files the streaming parser rejects
+        return extract_docx_text_python_docx(source)
+
+def extract_docx_text_python_docx(source):
     try:
-        doc_io = io.BytesIO(file_bytes)
-        document = Document(doc_io)
+        document = Document(source if isinstance(source, str) else io.BytesIO(source))
         
         full_text = []
         
@@ -86,140 +480,773 @@ def extract_docx_text(file_bytes):
     except Exception as e:
         return f"Błąd ekstrakcji tekstu: {str(e)}"
 
-def save_docx_file(file_data, file_name, client_name):
+def safe_client_name(client_name):
+    return ''.join(c for c in client_name if c.isalnum() or c in [' ', '_']).strip().replace(' ', '_')
+
+def client_folder(client_name):
+    # Create a client-specific folder
+    folder = os.path.join(DOCX_FOLDER, safe_client_name(client_name))
+    if not os.path.exists(folder):
+        os.makedirs(folder, exist_ok=True)
+    return folder
+
+def timestamped_path(folder, file_name):
+    timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+    base_name, ext = os.path.splitext(file_name)
+    return os.path.join(folder, f"{base_name}_{timestamp}{ext}")
+
+EXTRACTION_ERROR = "Błąd ekstrakcji tekstu"
+
+def extract_text(source):
+    try:
+        return run_conversion(extract_docx_text, source)
+    except ConversionError as e:
+        return f"{EXTRACTION_ERROR}: {str(e)}"
+
+def document_text(digest):
+    # Text is extracted once per distinct content and reused for every duplicate upload
+    text = blob_store.cached_text(digest)
+    if text is None:
+        text = extract_text(blob_store.blob_path(digest))
+        if not text.startswith(EXTRACTION_ERROR):
+            blob_store.save_text(digest, text)
+    return text
+
+def store_document(digest, file_name, client_name):
+    file_path = blob_store.link(digest, timestamped_path(client_folder(client_name), file_name))
+    return {
+        'path': file_path,
+        'text': document_text(digest),
+        'sha256': digest,
+        'size': os.path.getsize(blob_store.blob_path(digest))
+    }
+
+def stage_bytes(file_bytes):
+    # Queue content the store doesn't have yet for the background writer
+    digest = hashlib.sha256(file_bytes).hexdigest()
+    if blob_store.contains(digest):
+        return digest, None
+    temp_path = blob_store.new_temp_path()
+    disk_writer.append(temp_path, file_bytes)
+    return digest, temp_path
+
+def receive_document(client, client_name, file_name, digest, temp_path):
+    # With --ack received the client hears back as soon as the content is verified;
+    # the write, extraction and broadcasts follow, and a failure is reported afterwards
+    acked = False
+    if temp_path:
+        ticket = disk_writer.commit(temp_path)
+        if ACK_POLICY == 'received':
+            send_docx_ack(client, client_name, file_name)
+            acked = True
+        try:
+            ticket.wait(WRITE_TIMEOUT)
+        except WriteError:
+            disk_writer.discard(temp_path)
+            raise
+        blob_store.put_file(temp_path, digest)
+    elif blob_store.contains(digest):
+        blob_store.count_duplicate()
+    else:
+        raise UploadError(f"Treść pliku {file_name} nie zgadza się z zapowiedzianą sumą kontrolną")
+    return store_document(digest, file_name, client_name), acked
+
+def start_upload(client, request, client_name):
+    upload_id = request['upload_id']
+    file_name = os.path.basename(request['file_name'])
+    size = request.get('size', 0)
+    if upload_id in client.uploads:
+        raise UploadError(f"Przesyłanie {upload_id} już trwa")
+    if not 0 <= size <= MAX_UPLOAD_SIZE:
+        raise UploadError(f"Niedozwolony rozmiar pliku {file_name}: {size} bajtów")
+    
+    # Content the store already has is only hashed on the way in, never written
+    if request.get('sha256') and blob_store.contains(request['sha256']):
+        temp_path = None
+    else:
+        temp_path = blob_store.new_temp_path()
+    client.uploads[upload_id] = Upload(upload_id, file_name, size, temp_path, disk_writer)
+    log.info("Rozpoczęto odbiór pliku DOCX od %s: %s (%d bajtów)", client_name, file_name, size)
+
+def write_upload_chunk(client, request):
+    upload = client.uploads.get(request['upload_id'])
+    if upload is None:
+        # The rest of an upload that already failed and was reported
+        if request['upload_id'] in client.failed_uploads:
+            return
+        raise UploadError(f"Nieznane przesyłanie {request['upload_id']}")
+    try:
+        upload.write(request['data'])
+    except Exception:
+        del client.uploads[upload.upload_id]
+        client.failed_uploads.add(upload.upload_id)
+        upload.abort()
+        raise
+
+def finish_upload(client, request, client_name):
+    upload = client.uploads.pop(request['upload_id'], None)
+    if upload is None:
+        if request['upload_id'] in client.failed_uploads:
+            client.failed_uploads.discard(request['upload_id'])
+            return None, (None, False)
+        raise UploadError(f"Nieznane przesyłanie {request['upload_id']}")
+    try:
+        digest = upload.finish(request.get('sha256'))
+    except Exception:
+        upload.abort()
+        raise
+    return upload.file_name, receive_document(client, client_name, upload.file_name, digest, upload.temp_path)
+
+def cancel_upload(client, request, client_name):
+    upload = client.uploads.pop(request['upload_id'], None)
+    client.failed_uploads.discard(request['upload_id'])
+    if upload is not None:
+        upload.abort()
+        log.info("%s anulował przesyłanie pliku %s", client_name, upload.file_name)
+
+def abort_uploads(client):
+    for upload in client.uploads.values():
+        upload.abort()
+    client.uploads.clear()
+
+def client_folder_name(client_name):
+    return os.path.join(DOCX_FOLDER, safe_client_name(client_name))
+
+def send_docx_ack(client, client_name, file_name):
+    response = encode_message({
+        'type': 'docx_response', 
+        'message': f"Plik {file_name} został pomyślnie odebrany i zapisany w folderze '{client_folder_name(client_name)}' na serwerze."
+    })
+    client.send(response)
+
+def announce_docx(client, client_name, file_name, result, acked=False, room=DEFAULT_ROOM):
+    saved_path = result['path']
+    document_text = result['text']
+    
+    log.info("Zapisano plik: %s", saved_path, extra=fields(client=client_name, chars=len(document_text)))
+    if log.isEnabledFor(logging.DEBUG):
+        log.debug("Treść dokumentu %s:\n%s", file_name, truncate(document_text))
+    
+    if not acked:
+        send_docx_ack(client, client_name, file_name)
+    
+    if document_text.startswith(EXTRACTION_ERROR):
+        # The file is stored, but there is no text to preview or fetch with document_get,
+        # so only the uploader hears about it and the room is not told
+        log.warning("Nie udało się wyodrębnić tekstu z pliku %s od %s: %s", file_name, client_name, document_text)
+        client.send(encode_message({
+            'type': 'docx_response',
+            'message': f"Nie udało się odczytać treści pliku {file_name} ({document_text}); pozostali użytkownicy nie zostali powiadomieni."
+        }))
+        return
+    
+    # Recipients get the document id and a preview; the full text is sent only to
+    # those who ask for it with document_get
+    notification = {
+        'type': 'document_available',
+        'document_id': result['sha256'],
+        'file_name': file_name,
+        'client_name': client_name,
+        'size': result['size'],
+        'text_length': len(document_text),
+        'preview': document_text[:PREVIEW_LENGTH],
+        'room': room,
+        'message': f"Użytkownik {client_name} przesłał plik {file_name} do folderu '{client_folder_name(client_name)}' na serwerze."
+    }
+    broadcast(notification, client, room)
+
+def send_document_page(client, request):
+    document_id = str(request['document_id'])
+    try:
+        offset = max(0, int(request.get('offset', 0)))
+        length = min(max(1, int(request.get('length', DOCUMENT_PAGE_SIZE))), MAX_DOCUMENT_PAGE_SIZE)
+    except (TypeError, ValueError):
+        offset, length = 0, DOCUMENT_PAGE_SIZE
+    
+    # The id becomes part of a path in the blob store, so accept only a SHA-256 digest
+    text = None
+    if len(document_id) == 64 and all(c in '0123456789abcdef' for c in document_id):
+        text = blob_store.cached_text(document_id)
+    
+    if text is None:
+        client.send(encode_message({
+            'type': 'document_content',
+            'document_id': document_id,
+            'error': "Nie znaleziono dokumentu na serwerze."
+        }))
+        return
+    
+    page = text[offset:offset + length]
+    client.send(encode_message({
+        'type': 'document_content',
+        'document_id': document_id,
+        'offset': offset,
+        'length': len(page),
+        'total': len(text),
+        'text': page
+    }))
+
+def send_upload_error(client, error):
+    log.warning("Błąd odbioru pliku od %s: %s", client.name, error)
+    client.send(encode_message({
+        'type': 'docx_response',
+        'message': f"Wystąpił błąd podczas przesyłania pliku na serwer: {str(error)}"
+    }))
+
+def send_history(client, request):
+    # Frames are streamed straight from the log; a full outbound queue slows the reading down
+    if message_log is None:
+        client.send(encode_message({'type': 'history', 'error': "Historia wiadomości jest wyłączona na serwerze."}))
+        return
+    try:
+        limit = min(max(0, int(request.get('last', DEFAULT_HISTORY))), MAX_HISTORY)
+        since = float(request['since']) if request.get('since') is not None else None
+        until = float(request['until']) if request.get('until') is not None else None
+    except (TypeError, ValueError):
+        client.send(encode_message({'type': 'history', 'error': "Nieprawidłowe parametry historii."}))
+        return
+    
+    if since is None and until is None:
+        frames = message_log.last(limit)
+    else:
+        frames = message_log.between(since, until, limit)
+    client.send(encode_message({'type': 'history', 'limit': limit, 'since': since, 'until': until}))
+    count = 0
+    for frame in frames:
+        client.send(frame)
+        count += 1
+    client.send(encode_message({'type': 'history_end', 'count': count}))
+
+def change_room(client, request):
+    room = room_name(request.get('room'))
+    if room is None:
+        client.send(encode_message({'type': 'room', 'room': request.get('room'), 'error': "Nieprawidłowa nazwa pokoju."}))
+        return
+    if request['type'] == 'join':
+        clients.join(client, room)
+    else:
+        clients.leave(client, room)
+    client.send(encode_message({
+        'type': 'room',
+        'room': room,
+        'joined': request['type'] == 'join',
+        'members': len(clients.members(room)),
+        'rooms': clients.rooms_of(client)
+    }))
+
+def send_direct(client, client_name, request):
+    recipient = str(request['to'])
+    message = encode_message({'type': 'direct', 'from': client_name, 'message': request.get('message', '')})
+    if deliver_direct(recipient, message):
+        return
+    if bus is not None and recipient in remote_names:
+        # The recipient is connected to another server process
+        bus.publish(message, '@' + recipient)
+        return
+    client.send(encode_message({'type': 'direct', 'to': recipient, 'error': f"Nie ma połączonego klienta o nazwie {recipient}."}))
+
+def send_busy(client, request, message, retry_after):
+    # Sent instead of the usual reply; the client may repeat the request after retry_after seconds
+    client.send(encode_message({'type': 'busy', 'request': request.get('type'), 'message': message,
+                                'retry_after': round(retry_after, 2)}))
+
+def admit_request(client, request):
+    wait = rate_limits.check(client.rate_buckets, request.get('type'))
+    if not wait:
+        return True
+    if request.get('type') == 'upload_start' and 'upload_id' in request:
+        # The chunks and upload_end that follow are dropped like those of a failed upload
+        client.failed_uploads.add(request['upload_id'])
+    log.info("Odrzucono żądanie %s od %s: przekroczony limit", request.get('type'), client.name,
+             extra=fields(retry_after=round(wait, 2)))
+    send_busy(client, request, f"Za dużo żądań {request.get('type')}, spróbuj ponownie za {wait:.1f} s.", wait)
+    return False
+
+def handle_request(client, request):
+    start = time.perf_counter()
     try:
-        file_bytes = base64.b64decode(file_data)
+        if admit_request(client, request):
+            dispatch_request(client, request)
+    except ServerBusy as e:
+        send_busy(client, request, str(e), e.retry_after)
+    finally:
+        elapsed = time.perf_counter() - start
+        metrics.observe_request(request.get('type'), elapsed)
+        if SLOW_REQUEST and elapsed >= SLOW_REQUEST:
+            log.warning("Wolne żądanie", extra=fields(client=client.name, request=request.get('type'),
+                                                      duration_ms=round(elapsed * 1000, 1)))
+        elif log.isEnabledFor(logging.DEBUG):
+            log.debug("Żądanie obsłużone", extra=fields(client=client.name, request=request.get('type'),
+                                                        duration_ms=round(elapsed * 1000, 1)))
+
+def dispatch_request(client, request):
+    client_name = request.get('client_name', client.name)
+    if client_name != client.name and isinstance(client_name, str):
+        # Direct messages find clients by the name they use
+        clients.claim_name(client, client_name)
+    
+    if request.get('type') == 'ping':
+        client.send_message({'type': 'pong'})
+    
+    elif request.get('type') == 'pong':
+        # Receiving it already refreshed client.last_seen
+        pass
+    
+    elif request.get('type') == 'compression':
+        set_compression(client, request)
+    
+    elif request.get('type') == 'encoding':
+        set_encoding(client, request)
+    
+    elif request.get('type') == 'stats':
+        client.send(encode_message({'type': 'stats_response', 'data': metrics.snapshot()}))
+    
+    elif request.get('type') == 'image_to_ascii' and 'image_data' in request:
+        width = request.get('width', 60)
+        if type(width) is not int or not 1 <= width <= MAX_ASCII_WIDTH:
+            client.send(encode_message({'type': 'ascii_response',
+                                        'error': f"Nieprawidłowa szerokość ASCII art (dozwolone 1-{MAX_ASCII_WIDTH})."}))
+            return
+        ascii_art = image_to_ascii(request['image_data'], width, bool(request.get('prescaled')))
         
-        timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-        safe_client_name = ''.join(c for c in client_name if c.isalnum() or c in [' ', '_']).strip().replace(' ', '_')
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug("Konwersja obrazu dla %s (szerokość %s):\n%s", client_name, width, truncate(ascii_art))
         
-        # Create a client-specific folder
-        client_folder = os.path.join(DOCX_FOLDER, safe_client_name)
-        if not os.path.exists(client_folder):
-            os.makedirs(client_folder)
+        client.send_message({'type': 'ascii_response', 'data': ascii_art})
+    
+    elif request.get('type') == 'docx_file' and 'file_data' in request and 'file_name' in request:
+        file_data = request.get('file_data')
+        file_name = request.get('file_name')
+        room = upload_room(client, request)
+        if room is None:
+            send_room_error(client, request)
+            return
         
-        base_name, ext = os.path.splitext(file_name)
-        new_filename = f"{base_name}_{timestamp}{ext}"
-        file_path = os.path.join(client_folder, new_filename)
+        log.info("Otrzymano plik DOCX od %s: %s", client_name, file_name)
         
-        with open(file_path, 'wb') as f:
-            f.write(file_bytes)
+        try:
+            digest, temp_path = stage_bytes(base64.b64decode(file_data))
+            result, acked = receive_document(client, client_name, os.path.basename(file_name), digest, temp_path)
+        except Exception as e:
+            log.error("Błąd zapisywania pliku %s: %s", file_name, e)
+            response = encode_message({
+                'type': 'docx_response', 
+                'message': f"Wystąpił błąd podczas zapisywania pliku {file_name} na serwerze."
+            })
+            client.send(response)
+        else:
+            announce_docx(client, client_name, file_name, result, acked, room)
+    
+    elif request.get('type') == 'upload_chunk':
+        try:
+            write_upload_chunk(client, request)
+        except Exception as e:
+            send_upload_error(client, e)
+    
+    elif request.get('type') == 'upload_start' and 'upload_id' in request and 'file_name' in request:
+        try:
+            start_upload(client, request, client_name)
+        except Exception as e:
+            send_upload_error(client, e)
+    
+    elif request.get('type') == 'upload_end' and 'upload_id' in request:
+        room = upload_room(client, request)
+        if room is None:
+            # Refused like a text message to that room; the received data is dropped
+            cancel_upload(client, request, client_name)
+            send_room_error(client, request)
+            return
+        try:
+            file_name, (result, acked) = finish_upload(client, request, client_name)
+        except Exception as e:
+            send_upload_error(client, e)
+        else:
+            if result:
+                announce_docx(client, client_name, file_name, result, acked, room)
+    
+    elif request.get('type') == 'upload_cancel' and 'upload_id' in request:
+        cancel_upload(client, request, client_name)
+    
+    elif request.get('type') == 'document_get' and 'document_id' in request:
+        send_document_page(client, request)
+    
+    elif request.get('type') == 'history':
+        send_history(client, request)
+    
+    elif request.get('type') in ('join', 'leave'):
+        change_room(client, request)
+    
+    elif request.get('type') == 'direct' and 'to' in request:
+        send_direct(client, client_name, request)
+    
+    elif request.get('type') == 'text':
+        message = request.get('message', '')
+        room = target_room(client, request)
+        if room is None:
+            send_room_error(client, request)
+            return
+        log.debug("Odebrano od %s [%s]: %s", client_name, room, message)
+        prefix = "" if room == DEFAULT_ROOM else f"[{room}] "
+        broadcast({
+            'type': 'text',
+            'room': room,
+            'message': f"{prefix}Wiadomość od {client_name}: {message}"
+        }, client, room)
         
-        document_text = extract_docx_text(file_bytes)
-            
-        return {
-            'path': file_path,
-            'text': document_text
-        }
-    except Exception as e:
-        print(f"Błąd zapisywania pliku: {str(e)}")
-        return None
+    else:
+        log.debug("Nieznane żądanie od %s: %s", client_name, request)
+        client.send(encode_message(request))
 
 def handle_client(client):
+    reader = MessageReader(client.socket, on_data=client.received)
     while True:
         try:
-            data = client.socket.recv(1024000)
-            if not data:
+            request = reader.read_message()
+            if request is None:
                 break
             
             try:
-                request = json.loads(data.decode())
-                client_name = request.get('client_name', client.name)
-                
-                if request.get('type') == 'image_to_ascii' and 'image_data' in request:
-                    width = request.get('width', 60)
-                    ascii_art = image_to_ascii(request['image_data'], width)
-                    
-                    print(f"\nOtrzymano żądanie konwersji obrazu od {client_name}. Wynik:")
-                    print(ascii_art)
-                    
-                    response = json.dumps({'type': 'ascii_response', 'data': ascii_art})
-                    client.socket.send(response.encode())
-                
-                elif request.get('type') == 'docx_file' and 'file_data' in request and 'file_name' in request:
-                    file_data = request.get('file_data')
-                    file_name = request.get('file_name')
-                    
-                    print(f"\nOtrzymano plik DOCX od {client_name}: {file_name}")
-                    
-                    result = save_docx_file(file_data, file_name, client_name)
-                    
-                    if result:
-                        saved_path = result['path']
-                        document_text = result['text']
-                        
-                        print("\n===== ZAWARTOŚĆ DOKUMENTU =====")
-                        print(document_text)
-                        print("==============================\n")
-                        
-                        print(f"Zapisano plik: {saved_path}")
-                        
-                        # Get the client folder name for the response
-                        safe_client_name = ''.join(c for c in client_name if c.isalnum() or c in [' ', '_']).strip().replace(' ', '_')
-                        client_folder_name = os.path.join(DOCX_FOLDER, safe_client_name)
-                        
-                        response = json.dumps({
-                            'type': 'docx_response', 
-                            'message': f"Plik {file_name} został pomyślnie odebrany i zapisany w folderze '{client_folder_name}' na serwerze."
-                        })
-                        client.socket.send(response.encode())
-                        
-                        notification = json.dumps({
-                            'type': 'text',
-                            'message': f"Użytkownik {client_name} przesłał plik {file_name} do folderu '{client_folder_name}' na serwerze."
-                        })
-                        broadcast(notification.encode(), client)
-                        
-                        document_notification = json.dumps({
-                            'type': 'text',
-                            'message': f"Zawartość dokumentu {file_name} od {client_name} (zapisanego w folderze '{client_folder_name}'):\n\n{document_text}"
-                        })
-                        broadcast(document_notification.encode(), client)
-                        
-                    else:
-                        response = json.dumps({
-                            'type': 'docx_response', 
-                            'message': f"Wystąpił błąd podczas zapisywania pliku {file_name} na serwerze."
-                        })
-                        client.socket.send(response.encode())
-                
-                elif request.get('type') == 'text':
-                    message = request.get('message', '')
-                    print(f"\nOdebrano od {client_name}: {message}")
-                    response = json.dumps({
-                        'type': 'text',
-                        'message': f"Wiadomość od {client_name}: {message}"
-                    })
-                    broadcast(response.encode(), client)
-                    
-                else:
-                    print(f"\nOdebrano od {client_name}: {data.decode()}")
-                    client.socket.send(data)
-                    
-            except json.JSONDecodeError:
-                print(f"\nOdebrano od {client.name}: {data.decode()}")
-                client.socket.send(data)
+                handle_request(client, request)
+            except ProtocolError as e:
+                log.warning("Błędna wiadomość od %s: %s", client.name, e)
                 
+        except ProtocolError as e:
+            log.warning("Błąd protokołu klienta %s: %s", client.name, e)
+            break
         except Exception as e:
-            print(f"Błąd obsługi klienta {client.name}: {str(e)}")
+            log.error("Błąd obsługi klienta %s: %s", client.name, e)
             break
             
+    abort_uploads(client)
     remove_client(client)
-    client.socket.close()
+    client.close()
 
-def main():
-    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    server.bind(('localhost', 8888))
-    server.listen(5)
-    print("Serwer nasłuchuje...")
+_unix_client_ids = itertools.count(1)
 
+def unix_client_name():
+    # Unix socket peers have no port to tell them apart by
+    return f"Klient_unix_{next(_unix_client_ids)}"
+
+def open_unix_socket(path, backlog):
+    # A socket file left by a server that didn't shut down cleanly would make bind fail;
+    # one a running server still accepts on is left alone
+    if os.path.exists(path):
+        if not stat.S_ISSOCK(os.stat(path).st_mode):
+            raise OSError(f"{path} istnieje i nie jest gniazdem")
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(path)
+        except OSError:
+            os.unlink(path)
+        else:
+            raise OSError(f"Gniazdo {path} jest używane przez inny serwer")
+        finally:
+            probe.close()
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(path)
+    server.listen(backlog)
+    return server
+
+def accept_clients(server, unix=False):
     while True:
         client_socket, addr = server.accept()
-        client = Client(client_socket, addr)
-        clients.append(client)
-        print(f"Połączono z {client.name} ({addr})")
-        client_thread = threading.Thread(target=handle_client, args=(client,))
+        client = Client(client_socket, addr, unix_client_name() if unix else None)
+        client.start_writer()
+        register_client(client)
+        log.info("Połączono z %s (%s)", client.name, addr or "gniazdo Unix")
+        client_thread = threading.Thread(target=handle_client, args=(client,), daemon=True)
         client_thread.start()
 
+def run_threaded_server(host, port, backlog, reuse_port=False, unix_server=None):
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    # Connections the server closed (e.g. reaped ones) would otherwise block a restart
+    # while they linger in TIME_WAIT
+    server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if reuse_port:
+        server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    server.bind((host, port))
+    server.listen(backlog)
+    log.info("Serwer nasłuchuje na %s:%d", host, port)
+    if unix_server is not None:
+        log.info("Serwer nasłuchuje też na gnieździe %s", unix_server.getsockname())
+        threading.Thread(target=accept_clients, args=(unix_server, True), name='gniazdo_unix', daemon=True).start()
+
+    accept_clients(server)
+
+def outbound_stats():
+    totals = {'active': 0, 'queued': 0, 'dropped': 0, 'binary': 0}
+    for client in clients.snapshot():
+        queue = client.outbound.stats()
+        totals['active'] += 1
+        totals['binary'] += client.encoding == 'binary'
+        totals['queued'] += queue['depth']
+        totals['dropped'] += queue['dropped']
+    return totals
+
+def register_metric_sources():
+    metrics.register_source('connections', outbound_stats)
+    metrics.register_source('rooms', clients.stats)
+    metrics.register_source('heartbeat', lambda: dict(reaper_stats))
+    metrics.register_source('ascii_cache', ascii_cache.stats)
+    metrics.register_source('blob_store', blob_store.stats)
+    metrics.register_source('rate_limits', rate_limits.stats)
+    metrics.register_source('logging', dziennik.stats)
+    metrics.register_source('compression', compressor.stats)
+    if conversion_slots is not None:
+        metrics.register_source('conversions', conversion_slots.stats)
+    if bus is not None:
+        metrics.register_source('bus', lambda: dict(bus.stats(), remote_names=len(remote_names)))
+    if message_log is not None:
+        metrics.register_source('history', message_log.stats)
+    if disk_writer is not None:
+        metrics.register_source('disk_writer', disk_writer.stats)
+    if conversion_pool is not None:
+        metrics.register_source('conversion_pool', conversion_pool.stats)
+
+def parse_rate_limit(value):
+    name, _, limit = value.partition('=')
+    rate, _, burst = limit.partition('/')
+    try:
+        rate = float(rate)
+        burst = int(burst) if burst else max(1, int(rate // 6))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Niepoprawny limit: {value} (oczekiwano TYP=NA_MINUTĘ[/ZAPAS])")
+    if name not in REQUEST_TYPES or rate < 0 or burst < 1:
+        raise argparse.ArgumentTypeError(f"Niepoprawny limit: {value}")
+    return name, (rate, burst)
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Serwer komunikacyjny")
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=8888)
+    parser.add_argument('--backlog', type=int, default=None,
+                        help="Długość kolejki oczekujących połączeń (domyślnie 5, w trybie asyncio 1024)")
+    parser.add_argument('--unix-socket', default=None, metavar='ŚCIEŻKA',
+                        help="Nasłuchuj dodatkowo na gnieździe Unix dla klientów na tym samym komputerze")
+    parser.add_argument('--async', dest='use_async', action='store_true',
+                        help="Obsługa wszystkich połączeń w jednej pętli asyncio zamiast wątku na klienta")
+    parser.add_argument('--workers', type=int, default=None,
+                        help="Liczba wątków dla konwersji obrazów i dokumentów w trybie asyncio")
+    parser.add_argument('--shutdown-timeout', type=float, default=30.0,
+                        help="Czas (s) na dokończenie żądań w toku przy zamykaniu serwera asyncio")
+    parser.add_argument('--ascii-cache-entries', type=int, default=256,
+                        help="Maksymalna liczba zapamiętanych konwersji ASCII art (0 wyłącza pamięć podręczną)")
+    parser.add_argument('--ascii-cache-mb', type=float, default=16,
+                        help="Maksymalny rozmiar pamięci podręcznej ASCII art w MB")
+    parser.add_argument('--processes', type=int, default=None,
+                        help="Liczba procesów konwertujących obrazy i dokumenty (domyślnie liczba rdzeni, 0 = bez puli)")
+    parser.add_argument('--max-pending', type=int, default=None,
+                        help="Maksymalna liczba konwersji w kolejce puli procesów (domyślnie 4 na proces)")
+    parser.add_argument('--conversion-timeout', type=float, default=30.0,
+                        help="Limit czasu (s) pojedynczej konwersji w puli procesów")
+    parser.add_argument('--max-conversions', type=int, default=None,
+                        help="Maksymalna liczba konwersji obrazów wykonywanych naraz; kolejne dostają odpowiedź busy "
+                             "(domyślnie 2 na rdzeń, 0 = bez limitu)")
+    parser.add_argument('--rate-limit', type=parse_rate_limit, action='append', default=[],
+                        metavar='TYP=NA_MINUTĘ[/ZAPAS]',
+                        help="Limit żądań danego typu na klienta, np. image_to_ascii=60/10; 0 wyłącza limit "
+                             "(domyślnie: " + ", ".join(f"{name}={rate}/{burst}" for name, (rate, burst) in DEFAULT_RATE_LIMITS.items()) + ")")
+    parser.add_argument('--no-rate-limits', action='store_true',
+                        help="Wyłącz domyślne limity żądań (zostają tylko podane przez --rate-limit)")
+    parser.add_argument('--encoding', choices=ENCODINGS, default='binary',
+                        help="'binary' pozwala klientom wynegocjować zwarte kodowanie binarne, "
+                             "'json' wymusza JSON na wszystkich połączeniach (np. do podglądu ruchu)")
+    parser.add_argument('--compression', choices=tuple(CODECS) + ('off',), default='zlib',
+                        help="Kompresja dużych odpowiedzi dla klientów, którzy ją wynegocjują")
+    parser.add_argument('--compression-level', type=int, choices=range(10), default=6, metavar='0-9',
+                        help="Poziom kompresji (zlib: level, lzma: preset)")
+    parser.add_argument('--compression-min-bytes', type=int, default=1024,
+                        help="Kompresuj tylko ramki co najmniej tej wielkości")
+    parser.add_argument('--outbound-queue', type=int, default=1000,
+                        help="Maksymalna liczba wiadomości oczekujących na wysłanie do jednego klienta")
+    parser.add_argument('--slow-consumer', choices=POLICIES, default='coalesce',
+                        help="Co zrobić z rozgłoszeniem, gdy kolejka klienta jest pełna: "
+                             "odrzucić je, usunąć najstarsze rozgłoszenie z kolejki lub rozłączyć klienta")
+    parser.add_argument('--metrics-port', type=int, default=None,
+                        help="Udostępnij metryki w formacie Prometheus pod http://127.0.0.1:PORT/metrics")
+    parser.add_argument('--durability', choices=DURABILITY_POLICIES, default='batch',
+                        help="Synchronizacja odebranych plików z dyskiem: bez fsync, fsync grupowy lub fsync każdego pliku")
+    parser.add_argument('--ack', choices=('received', 'durable'), default='received',
+                        help="Potwierdzaj przesłanie pliku po odebraniu treści lub dopiero po trwałym zapisie")
+    parser.add_argument('--write-queue', type=int, default=1024,
+                        help="Maksymalna liczba operacji oczekujących na zapis na dysk")
+    parser.add_argument('--history-mb', type=float, default=256,
+                        help="Maksymalny rozmiar historii wiadomości na dysku w MB (0 wyłącza historię)")
+    parser.add_argument('--history-segment-mb', type=float, default=16,
+                        help="Rozmiar jednego segmentu historii w MB")
+    parser.add_argument('--history-days', type=float, default=30,
+                        help="Usuwaj segmenty historii starsze niż tyle dni (0 = bez limitu czasu)")
+    parser.add_argument('--heartbeat-interval', type=float, default=30.0,
+                        help="Po tylu sekundach ciszy serwer wysyła klientowi ping (0 wyłącza pingi i usuwanie martwych połączeń)")
+    parser.add_argument('--idle-timeout', type=float, default=90.0,
+                        help="Rozłącz klienta, od którego nic nie przyszło przez tyle sekund (0 = bez limitu)")
+    parser.add_argument('--send-timeout', type=float, default=30.0,
+                        help="Rozłącz klienta, gdy zapis do niego trwa dłużej niż tyle sekund (0 = bez limitu)")
+    parser.add_argument('--tcp-keepalive', type=int, default=60,
+                        help="Po tylu sekundach bezczynności jądro zaczyna sprawdzać połączenie TCP (0 wyłącza)")
+    parser.add_argument('--log-level', choices=LEVELS, default='info',
+                        help="Poziom dziennika; 'debug' pokazuje każdą wiadomość, wyniki konwersji i czasy żądań")
+    parser.add_argument('--log-file', default=None,
+                        help="Zapisuj dziennik do pliku zamiast na standardowe wyjście")
+    parser.add_argument('--log-payload-chars', type=int, default=500,
+                        help="Maksymalna liczba znaków ASCII art i treści dokumentu w dzienniku")
+    parser.add_argument('--slow-request-ms', type=float, default=1000,
+                        help="Zapisz ostrzeżenie o żądaniu obsługiwanym dłużej niż tyle ms (0 wyłącza)")
+    parser.add_argument('--instances', type=int, default=1,
+                        help="Liczba procesów serwera nasłuchujących na tym samym porcie (SO_REUSEPORT); "
+                             "rozgłoszenia przechodzą między nimi przez lokalną magistralę")
+    args = parser.parse_args(argv)
+    if args.unix_socket and not hasattr(socket, 'AF_UNIX'):
+        parser.error("--unix-socket wymaga gniazd Unix, niedostępnych w tym systemie")
+    if args.instances > 1 and not hasattr(socket, 'SO_REUSEPORT'):
+        parser.error("--instances wymaga SO_REUSEPORT, niedostępnego w tym systemie")
+    return args
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.instances > 1:
+        run_instances(args)
+    else:
+        run_instance(args)
+
+def run_instances(args):
+    # Each process is a complete server with its own pool and writer; the kernel
+    # spreads new connections between them
+    if args.processes is None:
+        args.processes = max(1, (os.cpu_count() or 1) // args.instances)
+    bus_dir = tempfile.mkdtemp(prefix='serwer_magistrala_')
+    hub = BusHub(os.path.join(bus_dir, 'bus.sock'))
+    context = multiprocessing.get_context('fork')
+    instances = [context.Process(target=run_instance, args=(args, index, hub.path), name=f'serwer-{index}')
+                 for index in range(args.instances)]
+    
+    def stop_instances(signum, frame):
+        for instance in instances:
+            if instance.is_alive():
+                instance.terminate()
+    
+    previous = signal.signal(signal.SIGTERM, stop_instances)
+    try:
+        for instance in instances:
+            instance.start()
+        hub.start()
+        print(f"Liczba procesów serwera na porcie {args.port}: {args.instances}")
+        for instance in instances:
+            instance.join()
+    except KeyboardInterrupt:
+        # Ctrl+C in a terminal reaches the whole process group; a SIGINT sent to this
+        # process alone has to be passed on
+        time.sleep(0.5)
+        stop_instances(None, None)
+        for instance in instances:
+            instance.join(args.shutdown_timeout)
+    finally:
+        signal.signal(signal.SIGTERM, previous)
+        hub.close()
+        shutil.rmtree(bus_dir, ignore_errors=True)
+
+def run_instance(args, index=0, bus_path=None):
+    # SIGTERM (from a parent instance, a service manager or a benchmark) shuts down the
+    # same way as Ctrl+C, so the conversion pool, the listeners and the socket file are cleaned up
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    dziennik.configure(args.log_level, args.log_file, args.log_payload_chars)
+    global SLOW_REQUEST
+    SLOW_REQUEST = args.slow_request_ms / 1000
+    ascii_cache.configure(args.ascii_cache_entries, int(args.ascii_cache_mb * 1024 * 1024))
+    
+    global MESSAGE_ENCODINGS
+    MESSAGE_ENCODINGS = () if args.encoding == 'json' else (args.encoding,)
+    
+    global COMPRESSION_CODECS, compressor
+    COMPRESSION_CODECS = () if args.compression == 'off' else (args.compression,)
+    compressor = Compressor(args.compression_level, args.compression_min_bytes)
+    
+    global OUTBOUND_QUEUE_SIZE, SLOW_CONSUMER_POLICY
+    OUTBOUND_QUEUE_SIZE = args.outbound_queue
+    SLOW_CONSUMER_POLICY = args.slow_consumer
+    
+    global HEARTBEAT_INTERVAL, IDLE_TIMEOUT, SEND_TIMEOUT, TCP_KEEPALIVE
+    HEARTBEAT_INTERVAL = args.heartbeat_interval
+    IDLE_TIMEOUT = args.idle_timeout
+    SEND_TIMEOUT = args.send_timeout
+    TCP_KEEPALIVE = args.tcp_keepalive
+    if HEARTBEAT_INTERVAL > 0:
+        threading.Thread(target=reap_clients, name='heartbeat', daemon=True).start()
+    
+    global ACK_POLICY, disk_writer
+    ACK_POLICY = args.ack
+    disk_writer = DiskWriter(args.write_queue, args.durability)
+    
+    global rate_limits, conversion_slots
+    limits = {} if args.no_rate_limits else dict(DEFAULT_RATE_LIMITS)
+    limits.update(args.rate_limit)
+    rate_limits = RateLimits(limits)
+    max_conversions = args.max_conversions if args.max_conversions is not None else (os.cpu_count() or 1) * 2
+    if max_conversions > 0:
+        conversion_slots = ConcurrencyLimit(max_conversions)
+    
+    global conversion_pool
+    if args.processes != 0:
+        conversion_pool = ConversionPool(args.processes, args.max_pending, args.conversion_timeout)
+    
+    global message_log
+    if args.history_mb > 0:
+        # Every process receives every broadcast, so each keeps a complete log of its own
+        folder = HISTORY_FOLDER if bus_path is None else os.path.join(HISTORY_FOLDER, f"instancja_{index}")
+        message_log = MessageLog(folder, int(args.history_segment_mb * 1024 * 1024), int(args.history_mb * 1024 * 1024),
+                                 args.history_days * 86400 if args.history_days else None)
+        if args.history_days:
+            threading.Thread(target=expire_history, name='historia', daemon=True).start()
+    
+    global bus, instance_index
+    if bus_path is not None:
+        instance_index = index
+        bus = BusClient(bus_path, deliver_bus_message)
+        clients.on_name = announce_name
+        # Processes that joined the bus earlier announce the names they already have
+        bus.publish(b'', NAMES_REQUEST)
+        metrics.register_source('instance', lambda: {'index': index, 'pid': os.getpid()})
+    register_metric_sources()
+    if args.metrics_port:
+        # With several instances each one serves its own metrics on the next port
+        metrics_port = args.metrics_port + index
+        start_http_endpoint(metrics, metrics_port)
+        log.info("Metryki dostępne pod http://127.0.0.1:%d/metrics", metrics_port)
+    
+    unix_server = None
+    try:
+        if args.unix_socket and index == 0:
+            # A socket file can have only one listener, so with several instances the first one takes it
+            unix_server = open_unix_socket(args.unix_socket, args.backlog if args.backlog is not None else 128)
+        if args.use_async:
+            import serwer_async
+            serwer_async.main(args, reuse_port=bus_path is not None, unix_server=unix_server)
+        else:
+            run_threaded_server(args.host, args.port, args.backlog if args.backlog is not None else 5,
+                                reuse_port=bus_path is not None, unix_server=unix_server)
+    except KeyboardInterrupt:
+        if bus_path is not None:
+            # The parent may pass the same stop request on; let the cleanup below finish
+            signal.signal(signal.SIGTERM, signal.SIG_IGN)
+        log.info("Zamykanie serwera...")
+    finally:
+        if bus is not None:
+            bus.close()
+        if message_log is not None:
+            message_log.close()
+        if conversion_pool is not None:
+            conversion_pool.shutdown()
+        if disk_writer is not None:
+            disk_writer.shutdown()
+        if unix_server is not None:
+            unix_server.close()
+            try:
+                os.unlink(args.unix_socket)
+            except OSError:
+                pass
+        dziennik.shutdown()
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    # Run through the importable module so serwer_async and pool workers see the same globals
+    import serwer_w
+    serwer_w.main()
@@ -0,0 +1,44 @@
+import base64
+
+import pytest
+
+import binarny
+
+@pytest.mark.parametrize('message', [
+    {'type': 'ping'},
+    {'type': 'text', 'message': 'zażółć gęślą jaźń', 'client_name': 'a', 'room': 'kuchnia'},
+    {'type': 'text', 'message': 'x' * 100000},
+    {'type': 'direct', 'to': 'b', 'message': ''},
+    {'type': 'image_to_ascii', 'image_data': b'\x89PNG', 'width': 80, 'prescaled': True},
+    {'type': 'image_to_ascii', 'width': -1, 'prescaled': False},
+])
+def test_round_trip(message):
+    assert binarny.decode(binarny.encode(message)) == message
+
+def test_base64_image_goes_raw():
+    payload = binarny.encode({'type': 'image_to_ascii', 'image_data': base64.b64encode(b'abc').decode()})
+    assert binarny.decode(payload)['image_data'] == b'abc'
+
+@pytest.mark.parametrize('message', [
+    {'type': 'history_end'},
+    {'type': 'text', 'message': 'hej', 'extra': 1},
+    {'type': 'text', 'message': 5},
+    {'type': 'join', 'room': 'x' * 70000},
+    {'type': 'image_to_ascii', 'width': '80'},
+    {'type': 'image_to_ascii', 'width': 2 ** 63},
+    {'type': 'image_to_ascii', 'prescaled': 1},
+    {'type': 'image_to_ascii', 'image_data': 'nie base64!'},
+])
+def test_falls_back_to_json(message):
+    assert binarny.encode(message) is None
+
+@pytest.mark.parametrize('payload', [
+    b'',
+    b'\xff\x00',
+    b'\x01\x80',
+    binarny.encode({'type': 'text', 'message': 'hej'})[:-1],
+    binarny.encode({'type': 'text', 'message': 'hej'}) + b'\x00',
+])
+def test_invalid_payload(payload):
+    with pytest.raises(ValueError):
+        binarny.decode(payload)
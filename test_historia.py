@@ -0,0 +1,95 @@
+import os
+import time
+
+from historia import MessageLog
+
+def frames(count, start=0):
+    return [f"wiadomość {i}".encode() for i in range(start, start + count)]
+
+def test_last(tmp_path):
+    log = MessageLog(str(tmp_path))
+    for frame in frames(10):
+        log.append(frame)
+    assert list(log.last(3)) == frames(3, 7)
+    assert list(log.last(50)) == frames(10)
+    assert list(log.last(0)) == []
+    log.close()
+
+def test_last_across_segments(tmp_path):
+    log = MessageLog(str(tmp_path), segment_bytes=30)
+    for frame in frames(20):
+        log.append(frame)
+    assert log.stats()['segments'] > 1
+    assert list(log.last(15)) == frames(15, 5)
+    log.close()
+
+def test_between(tmp_path):
+    log = MessageLog(str(tmp_path), segment_bytes=30)
+    for i, frame in enumerate(frames(20)):
+        log.append(frame, timestamp=1000.0 + i)
+    assert list(log.between(1005.0, 1008.0)) == frames(3, 5)
+    assert list(log.between(since=1015.0)) == frames(5, 15)
+    assert list(log.between(until=1002.0)) == frames(2)
+    assert list(log.between(1003.0, limit=4)) == frames(4, 3)
+    assert list(log.between(2000.0)) == []
+    log.close()
+
+def test_reopen_keeps_messages(tmp_path):
+    log = MessageLog(str(tmp_path), segment_bytes=30)
+    for frame in frames(10):
+        log.append(frame)
+    log.close()
+    log = MessageLog(str(tmp_path), segment_bytes=30)
+    log.append(b'nowa')
+    assert list(log.last(3)) == frames(2, 8) + [b'nowa']
+    log.close()
+
+def test_reopen_drops_torn_write(tmp_path):
+    log = MessageLog(str(tmp_path))
+    for frame in frames(3):
+        log.append(frame)
+    log.close()
+    # A crash between writing the message and its index entry
+    with open(os.path.join(str(tmp_path), f"{0:020d}.log"), 'ab') as f:
+        f.write(b'niedokonczona')
+    log = MessageLog(str(tmp_path))
+    log.append(b'nowa')
+    assert list(log.last(10)) == frames(3) + [b'nowa']
+    log.close()
+
+def test_size_retention(tmp_path):
+    log = MessageLog(str(tmp_path), segment_bytes=100, max_bytes=300)
+    for frame in frames(200):
+        log.append(frame)
+    stats = log.stats()
+    assert stats['deleted_segments'] > 0
+    assert stats['bytes'] <= 300 + 100 + 200
+    assert list(log.last(1)) == frames(1, 199)
+    log.close()
+
+def test_time_retention_expires_active_segment(tmp_path):
+    log = MessageLog(str(tmp_path), retention_seconds=60)
+    now = time.time()
+    for frame in frames(5):
+        log.append(frame, timestamp=now - 120)
+    log.expire()
+    assert list(log.last(10)) == []
+    assert log.stats()['deleted_segments'] == 1
+    log.append(b'nowa')
+    assert list(log.last(10)) == [b'nowa']
+    log.close()
+
+def test_time_retention_keeps_recent(tmp_path):
+    log = MessageLog(str(tmp_path), retention_seconds=60)
+    for frame in frames(5):
+        log.append(frame)
+    log.expire()
+    assert list(log.last(10)) == frames(5)
+    log.close()
+
+def test_old_messages_roll_on_append(tmp_path):
+    log = MessageLog(str(tmp_path), retention_seconds=60)
+    log.append(b'stara', timestamp=time.time() - 120)
+    log.append(b'nowa')
+    assert list(log.last(10)) == [b'nowa']
+    log.close()
@@ -0,0 +1,85 @@
+import pytest
+
+from protokol import (FLAG_BINARY, FLAG_CHUNK, FLAG_LZMA, FLAG_ZLIB, HEADER, HEADER_SIZE, PROTOCOL_VERSION,
+                      Compressor, FrameDecoder, ProtocolError, decode_payload, encode_binary_message, encode_chunk,
+                      encode_frame, encode_message, to_binary_frame)
+
+def test_frame_split_across_reads():
+    frame = encode_message({'type': 'text', 'message': 'zażółć'})
+    decoder = FrameDecoder()
+    for i in range(len(frame) - 1):
+        decoder.feed(frame[i:i + 1])
+        assert decoder.next_message() is None
+    decoder.feed(frame[-1:])
+    assert decoder.next_message() == {'type': 'text', 'message': 'zażółć'}
+    assert decoder.pending() == 0
+
+def test_pipelined_frames():
+    messages = [{'type': 'text', 'message': str(i)} for i in range(5)]
+    decoder = FrameDecoder()
+    decoder.feed(b''.join(encode_message(message) for message in messages))
+    assert [decoder.next_message() for _ in messages] == messages
+    assert decoder.next_message() is None
+
+def test_frame_too_large():
+    decoder = FrameDecoder(max_frame_size=10)
+    decoder.feed(encode_message({'type': 'text', 'message': 'x' * 20}))
+    with pytest.raises(ProtocolError):
+        decoder.next_frame()
+
+def test_wrong_version():
+    decoder = FrameDecoder()
+    decoder.feed(HEADER.pack(PROTOCOL_VERSION + 1, 0, 2) + b'{}')
+    with pytest.raises(ProtocolError):
+        decoder.next_frame()
+
+def test_decode_json():
+    assert decode_payload(b'{"type": "ping"}') == {'type': 'ping'}
+
+@pytest.mark.parametrize('payload', [b'{nie json', b'[1, 2]', b'\xff\xfe'])
+def test_decode_invalid_json(payload):
+    with pytest.raises(ProtocolError):
+        decode_payload(payload)
+
+def test_decode_chunk():
+    frame = encode_chunk(7, b'abc')
+    message = decode_payload(frame[HEADER_SIZE:], frame[1])
+    assert frame[1] == FLAG_CHUNK
+    assert message['upload_id'] == 7
+    assert bytes(message['data']) == b'abc'
+
+def test_decode_binary():
+    frame = encode_binary_message({'type': 'text', 'message': 'hej', 'room': 'ogólny'})
+    assert frame[1] == FLAG_BINARY
+    assert decode_payload(frame[HEADER_SIZE:], frame[1]) == {'type': 'text', 'message': 'hej', 'room': 'ogólny'}
+
+def test_decode_invalid_binary():
+    with pytest.raises(ProtocolError):
+        decode_payload(b'\xff\x00', FLAG_BINARY)
+
+def test_unknown_flags():
+    with pytest.raises(ProtocolError):
+        decode_payload(b'{}', 0x80)
+
+@pytest.mark.parametrize('codec, flag', [('zlib', FLAG_ZLIB), ('lzma', FLAG_LZMA)])
+@pytest.mark.parametrize('encode', [encode_message, encode_binary_message])
+def test_compressed_round_trip(codec, flag, encode):
+    message = {'type': 'text', 'message': 'ala ma kota ' * 500}
+    frame = Compressor(min_size=0).compress(encode(message), codec)
+    assert frame[1] & flag
+    assert decode_payload(frame[HEADER_SIZE:], frame[1]) == message
+
+def test_small_frames_stay_uncompressed():
+    frame = encode_message({'type': 'ping'})
+    assert Compressor(min_size=1024).compress(frame, 'zlib') is frame
+
+def test_to_binary_frame():
+    message = {'type': 'text', 'message': 'hej'}
+    frame = to_binary_frame(encode_message(message))
+    assert frame[1] == FLAG_BINARY
+    assert decode_payload(frame[HEADER_SIZE:], frame[1]) == message
+    # Types without a binary schema and frames that are not plain JSON are left alone
+    other = encode_message({'type': 'history_end'})
+    assert to_binary_frame(other) is other
+    chunk = encode_frame(b'abc', FLAG_CHUNK)
+    assert to_binary_frame(chunk) is chunk
@@ -0,0 +1,78 @@
+import os
+
+import pytest
+
+from zapis_w_tle import DiskWriter, WriteError
+
+@pytest.fixture(params=['none', 'batch', 'always'])
+def writer(request):
+    writer = DiskWriter(durability=request.param)
+    yield writer
+    writer.shutdown()
+
+def test_append_and_commit(writer, tmp_path):
+    path = str(tmp_path / 'plik')
+    writer.append(path, b'ala ')
+    writer.append(path, b'ma kota')
+    writer.commit(path).wait(5)
+    with open(path, 'rb') as f:
+        assert f.read() == b'ala ma kota'
+    assert writer.stats()['bytes_written'] == 11
+
+def test_commit_without_data(writer, tmp_path):
+    path = str(tmp_path / 'pusty')
+    writer.commit(path).wait(5)
+    assert os.path.getsize(path) == 0
+
+def test_discard(writer, tmp_path):
+    path = str(tmp_path / 'plik')
+    writer.append(path, b'dane')
+    writer.discard(path)
+    # Operations are applied in submission order, so the file is gone once a later commit is done
+    writer.commit(str(tmp_path / 'inny')).wait(5)
+    assert not os.path.exists(path)
+
+def test_write_error_reaches_ticket(writer, tmp_path):
+    path = str(tmp_path / 'brak' / 'plik')
+    writer.append(path, b'dane')
+    ticket = writer.commit(path)
+    with pytest.raises(WriteError):
+        ticket.wait(5)
+    assert writer.stats()['errors'] == 1
+
+def test_commit_error_reaches_ticket(writer, tmp_path):
+    # Nothing appended, so the file is first opened at commit
+    ticket = writer.commit(str(tmp_path / 'brak' / 'plik'))
+    with pytest.raises(WriteError):
+        ticket.wait(5)
+
+def test_error_does_not_affect_other_files(writer, tmp_path):
+    bad = str(tmp_path / 'brak' / 'plik')
+    good = str(tmp_path / 'dobry')
+    writer.append(bad, b'dane')
+    writer.append(good, b'dane')
+    bad_ticket = writer.commit(bad)
+    writer.commit(good).wait(5)
+    with pytest.raises(WriteError):
+        bad_ticket.wait(5)
+    with open(good, 'rb') as f:
+        assert f.read() == b'dane'
+
+def test_batch_syncs_every_commit(tmp_path):
+    writer = DiskWriter(durability='batch', batch_interval=0.05)
+    try:
+        paths = [str(tmp_path / f"plik{i}") for i in range(5)]
+        for path in paths:
+            writer.append(path, b'dane')
+        tickets = [writer.commit(path) for path in paths]
+        for ticket in tickets:
+            ticket.wait(5)
+        stats = writer.stats()
+        assert stats['fsyncs'] == 5
+        assert 1 <= stats['batches'] <= 5
+    finally:
+        writer.shutdown()
+
+def test_unknown_durability():
+    with pytest.raises(ValueError):
+        DiskWriter(durability='czasem')
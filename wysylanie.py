@@ -0,0 +1,113 @@
+import itertools
+import os
+import queue
+import threading
+
+from protokol import encode_message
+from przesylanie import UploadCancelled, upload_file
+
+class SendJob:
+    def __init__(self, job_id, kind, description, total=0):
+        self.job_id = job_id
+        # 'message' or 'file'
+        self.kind = kind
+        self.description = description
+        self.total = total
+        self.sent = 0
+        # pending -> sending -> sent / cancelled / failed
+        self.status = 'pending'
+        self.error = None
+        self._cancelled = threading.Event()
+
+    def cancel(self):
+        self._cancelled.set()
+
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+class Sender:
+    def __init__(self, sock, on_progress=None, on_finished=None, max_pending=256):
+        # One writer thread owns the socket's sending side, so callers never block on
+        # the network and frames of different requests are never interleaved.
+        # Callbacks run on the writer thread: on_progress(job) after each upload chunk
+        # that moves it by at least one percent, on_finished(job) once it is done
+        self.sock = sock
+        # Swapped for protokol.encode_binary_message once the server agrees to binary messages
+        self.encode = encode_message
+        self.on_progress = on_progress
+        self.on_finished = on_finished
+        self._queue = queue.Queue(max_pending)
+        self._jobs = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name='wysylanie', daemon=True)
+        self._thread.start()
+
+    def send_message(self, message, description=None):
+        frame = self.encode(message)
+        job = self._submit('message', description or message.get('type', ''), len(frame))
+        self._queue.put((job, lambda: self.sock.sendall(frame)))
+        return job
+
+    def send_file(self, file_path, client_name, room=None):
+        job = self._submit('file', os.path.basename(file_path), os.path.getsize(file_path))
+        self._queue.put((job, lambda: self._upload(job, file_path, client_name, room)))
+        return job
+
+    def cancel(self, job_id=None):
+        # Without job_id every queued and running job is cancelled
+        with self._lock:
+            jobs = list(self._jobs.values()) if job_id is None else [self._jobs.get(job_id)]
+        for job in jobs:
+            if job is not None:
+                job.cancel()
+
+    def pending(self):
+        with self._lock:
+            return list(self._jobs.values())
+
+    def close(self, timeout=5.0):
+        self.cancel()
+        self._queue.put((None, None))
+        self._thread.join(timeout)
+
+    def _submit(self, kind, description, total):
+        job = SendJob(next(self._ids), kind, description, total)
+        with self._lock:
+            self._jobs[job.job_id] = job
+        return job
+
+    def _upload(self, job, file_path, client_name, room):
+        step = max(1, job.total // 100)
+        reported = [0]
+
+        def progress(sent, size):
+            job.sent = sent
+            if self.on_progress is not None and (sent - reported[0] >= step or sent == size):
+                reported[0] = sent
+                self.on_progress(job)
+
+        upload_file(self.sock.sendall, file_path, client_name, progress=progress, cancelled=job.cancelled, room=room)
+
+    def _run(self):
+        while True:
+            job, action = self._queue.get()
+            if job is None:
+                return
+            if job.cancelled():
+                job.status = 'cancelled'
+            else:
+                job.status = 'sending'
+                try:
+                    action()
+                    job.sent = job.total
+                    job.status = 'sent'
+                except UploadCancelled:
+                    job.status = 'cancelled'
+                except Exception as e:
+                    job.status = 'failed'
+                    job.error = e
+            with self._lock:
+                self._jobs.pop(job.job_id, None)
+            if self.on_finished is not None:
+                self.on_finished(job)
@@ -0,0 +1,168 @@
+import os
+import queue
+import threading
+import time
+
+DURABILITY_POLICIES = ('none', 'batch', 'always')
+
+class WriteError(Exception):
+    pass
+
+class WriteTicket:
+    def __init__(self, path):
+        self.path = path
+        self.error = None
+        self._done = threading.Event()
+
+    def _finish(self, error=None):
+        self.error = error
+        self._done.set()
+
+    def done(self):
+        return self._done.is_set()
+
+    def wait(self, timeout=None):
+        if not self._done.wait(timeout):
+            raise WriteError(f"Przekroczono czas zapisu pliku {os.path.basename(self.path)}")
+        if self.error is not None:
+            raise WriteError(f"Nie udało się zapisać pliku {os.path.basename(self.path)}: {self.error}")
+
+def _close_quietly(f):
+    if f is not None:
+        try:
+            f.close()
+        except OSError:
+            pass
+
+class DiskWriter:
+    def __init__(self, max_pending=1024, durability='batch', batch_interval=0.01, max_batch=64):
+        if durability not in DURABILITY_POLICIES:
+            raise ValueError(f"Nieznana polityka trwałości zapisu: {durability}")
+        self.durability = durability
+        self.batch_interval = batch_interval
+        self.max_batch = max_batch
+        self.bytes_written = 0
+        self.fsyncs = 0
+        self.batches = 0
+        self.errors = 0
+        self._queue = queue.Queue(max_pending)
+        self._files = {}
+        self._failed = {}
+        self._unsynced = []
+        self._thread = threading.Thread(target=self._run, name='zapis_w_tle', daemon=True)
+        self._thread.start()
+
+    # Operations on one path are applied in submission order by the writer thread;
+    # a full queue blocks the submitter, which bounds memory held by pending writes
+
+    def append(self, path, data):
+        self._queue.put(('append', path, data))
+
+    def commit(self, path):
+        ticket = WriteTicket(path)
+        self._queue.put(('commit', path, ticket))
+        return ticket
+
+    def discard(self, path):
+        self._queue.put(('discard', path, None))
+
+    def shutdown(self, timeout=10.0):
+        self._queue.put(('stop', None, None))
+        self._thread.join(timeout)
+
+    def _run(self):
+        while True:
+            # While commits wait for fsync, only wait for more work until the batch is due
+            timeout = None
+            if self._unsynced:
+                timeout = max(0.0, self._unsynced[0][2] + self.batch_interval - time.monotonic())
+            try:
+                op, path, arg = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                self._sync_batch()
+                continue
+            if op == 'stop':
+                self._sync_batch()
+                return
+            try:
+                self._apply(op, path, arg)
+            except OSError as e:
+                self._fail(path, e)
+            if self._unsynced and (self._queue.empty() or len(self._unsynced) >= self.max_batch):
+                self._sync_batch()
+
+    def _apply(self, op, path, arg):
+        if op == 'append':
+            if path in self._failed:
+                return
+            f = self._files.get(path)
+            if f is None:
+                f = self._files[path] = open(path, 'wb')
+            f.write(arg)
+            self.bytes_written += len(arg)
+        elif op == 'commit':
+            error = self._failed.pop(path, None)
+            f = self._files.pop(path, None)
+            if error is not None:
+                arg._finish(error)
+                return
+            try:
+                if f is None:
+                    # Nothing was appended: an empty file
+                    f = open(path, 'wb')
+                f.flush()
+                if self.durability == 'batch':
+                    self._unsynced.append((f, arg, time.monotonic()))
+                    return
+                if self.durability == 'always':
+                    os.fsync(f.fileno())
+                    self.fsyncs += 1
+                f.close()
+            except OSError as e:
+                # Reported to the waiting ticket right away, not when it times out
+                self.errors += 1
+                _close_quietly(f)
+                arg._finish(e)
+                return
+            arg._finish()
+        elif op == 'discard':
+            self._failed.pop(path, None)
+            f = self._files.pop(path, None)
+            if f is not None:
+                f.close()
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def _fail(self, path, error):
+        self.errors += 1
+        f = self._files.pop(path, None)
+        _close_quietly(f)
+        self._failed[path] = error
+
+    def _sync_batch(self):
+        batch, self._unsynced = self._unsynced, []
+        if not batch:
+            return
+        self.batches += 1
+        for f, ticket, _ in batch:
+            try:
+                os.fsync(f.fileno())
+                self.fsyncs += 1
+                f.close()
+                ticket._finish()
+            except OSError as e:
+                self.errors += 1
+                _close_quietly(f)
+                ticket._finish(e)
+
+    def stats(self):
+        return {
+            'durability': self.durability,
+            'pending': self._queue.qsize(),
+            'bytes_written': self.bytes_written,
+            'fsyncs': self.fsyncs,
+            'batches': self.batches,
+            'errors': self.errors,
+        }